@@ -0,0 +1,476 @@
+"""
+In-process stand-ins for Postgres and RabbitMq answering after a simulated
+latency, so the application can be benchmarked without docker-compose.
+"""
+import asyncio
+import itertools
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import (Any, Callable, Deque, Dict, Iterable, List, Optional,
+                    Sequence, Set, Tuple, Type)
+import aioapp
+import aioapp.amqp
+import asyncpg
+from aioamqp.envelope import Envelope as AmqpEnvelope
+from aioamqp.exceptions import PublishFailed
+from aioamqp.properties import Properties as AmqpProperties
+from aioapp.db.postgres import Connection
+from aioapp.tracer import Span
+import myaioapp.app
+from myaioapp.config import Config
+from myaioapp.logic.db import (Postgres, GetDate, GetWeek, InsertOutbox,
+                               ClaimOutbox, DeleteOutbox, StatementRegistry)
+from myaioapp.logic.amqp import AmqpConsumerChannel, AmqpPublisherChannel
+from myaioapp.tracing import NOOP_SPAN
+
+RowsFactory = Callable[[Tuple], List['Record']]
+
+
+class Record:
+    """
+    Row with the part of the ``asyncpg.Record`` interface used by
+    ``Result``: ``keys()`` and access by position or column name.
+    """
+    __slots__ = ('_keys', '_values')
+
+    def __init__(self, **values: Any) -> None:
+        self._keys = tuple(values)
+        self._values = tuple(values.values())
+
+    def keys(self) -> Iterable[str]:
+        return iter(self._keys)
+
+    def __getitem__(self, key: Any) -> Any:
+        if isinstance(key, str):
+            return self._values[self._keys.index(key)]
+        return self._values[key]
+
+
+def default_rows() -> Dict[str, RowsFactory]:
+    outbox: Dict[int, Record] = {}
+    outbox_seq = itertools.count(1)
+    claimed: Dict[int, float] = {}
+
+    def get_week(params: Tuple) -> List[Record]:
+        now = datetime.now()
+        return [Record(date=now - timedelta(days=days))
+                for days in range(6, -1, -1)]
+
+    def insert_outbox(params: Tuple) -> List[Record]:
+        id = next(outbox_seq)
+        outbox[id] = Record(id=id, exchange_name=params[0],
+                            routing_key=params[1], payload=params[2])
+        return []
+
+    def claim_outbox(params: Tuple) -> List[Record]:
+        now = time.monotonic()
+        ids = [id for id in sorted(outbox)
+               if claimed.get(id, 0) < now][:params[0]]
+        for id in ids:
+            claimed[id] = now + params[1]
+        return [outbox[id] for id in ids]
+
+    def delete_outbox(params: Tuple) -> List[Record]:
+        for id in params[0]:
+            outbox.pop(id, None)
+            claimed.pop(id, None)
+        return []
+
+    return {
+        GetDate.__sql__: lambda params: [Record(now=datetime.now())],
+        GetWeek.__sql__: get_week,
+        InsertOutbox.__sql__: insert_outbox,
+        ClaimOutbox.__sql__: claim_outbox,
+        DeleteOutbox.__sql__: delete_outbox,
+    }
+
+
+class FakeTransaction:
+
+    async def start(self) -> None:
+        pass
+
+    async def commit(self) -> None:
+        pass
+
+    async def rollback(self) -> None:
+        pass
+
+
+class FakeStatement:
+    """
+    Prepared statement handle, invalidated like the ``asyncpg`` one when its
+    connection is released to the pool.
+    """
+
+    def __init__(self, conn: 'FakeConnection', query: str) -> None:
+        self._conn = conn
+        self._query = query
+        self._release_ctr = conn._pool_release_ctr
+
+    async def fetch(self, *args: Any,
+                    timeout: Optional[float] = None) -> List[Record]:
+        if self._release_ctr != self._conn._pool_release_ctr:
+            raise asyncpg.InterfaceError(
+                'cannot call PreparedStatement.fetch(): the underlying '
+                'connection has been released back to the pool')
+        return await self._conn.fetch(self._query, *args, timeout=timeout)
+
+
+class FakeCursor:
+    """
+    Cursor factory and cursor of ``FakeConnection.cursor``, running the query
+    on the first fetch.
+    """
+
+    def __init__(self, conn: 'FakeConnection', query: str, args: Tuple,
+                 timeout: Optional[float]) -> None:
+        self._conn = conn
+        self._query = query
+        self._args = args
+        self._timeout = timeout
+        self._rows: Optional[List[Record]] = None
+
+    def __await__(self) -> Any:
+        return self._open().__await__()
+
+    async def _open(self) -> 'FakeCursor':
+        if self._rows is None:
+            self._rows = await self._conn.fetch(self._query, *self._args,
+                                                timeout=self._timeout)
+        return self
+
+    async def fetch(self, n: int) -> List[Record]:
+        await self._open()
+        rows, self._rows = self._rows[:n], self._rows[n:]  # type: ignore
+        return rows
+
+    def __aiter__(self) -> 'FakeCursor':
+        return self
+
+    async def __anext__(self) -> Record:
+        rows = await self.fetch(1)
+        if not rows:
+            raise StopAsyncIteration
+        return rows[0]
+
+
+class FakeConnection:
+    """
+    Stand-in for a pooled ``asyncpg`` connection: every query waits
+    ``latency`` seconds, or raises ``asyncio.TimeoutError`` after
+    ``timeout``, and returns the rows registered for its SQL, or no rows.
+    Queries are parsed once per connection into its statement cache, which
+    ``prepare`` bypasses like the ``asyncpg`` one.
+    """
+
+    def __init__(self, db: 'FakePostgres') -> None:
+        self._db = db
+        self._pool_release_ctr = 0
+        self._stmt_cache: set = set()
+
+    def transaction(self) -> FakeTransaction:
+        return FakeTransaction()
+
+    def is_in_transaction(self) -> bool:
+        return False
+
+    def cursor(self, query: str, *args: Any, prefetch: Optional[int] = None,
+               timeout: Optional[float] = None) -> FakeCursor:
+        return FakeCursor(self, query, args, timeout)
+
+    async def prepare(self, query: str) -> FakeStatement:
+        self._db.prepares += 1
+        return FakeStatement(self, query)
+
+    async def _get_statement(self, query: str,
+                             timeout: Optional[float]) -> None:
+        if query not in self._stmt_cache:
+            self._stmt_cache.add(query)
+            self._db.prepares += 1
+
+    async def fetch(self, query: str, *args: Any,
+                    timeout: Optional[float] = None) -> List[Record]:
+        await self._get_statement(query, timeout)
+        await asyncio.wait_for(
+            asyncio.sleep(self._db.latency, loop=self._db.loop), timeout,
+            loop=self._db.loop)
+        self._db.queries += 1
+        factory = self._db.rows.get(query)
+        return factory(args) if factory else []
+
+    async def fetchrow(self, query: str, *args: Any,
+                       timeout: Optional[float] = None) -> Optional[Record]:
+        rows = await self.fetch(query, *args, timeout=timeout)
+        return rows[0] if rows else None
+
+    async def fetchval(self, query: str, *args: Any,
+                       timeout: Optional[float] = None) -> Any:
+        row = await self.fetchrow(query, *args, timeout=timeout)
+        return row[0] if row else None
+
+    async def execute(self, query: str, *args: Any,
+                      timeout: Optional[float] = None) -> str:
+        await self.fetch(query, *args, timeout=timeout)
+        return 'UPDATE 1'
+
+    async def executemany(self, query: str, args: Iterable[Sequence],
+                          timeout: Optional[float] = None) -> None:
+        await self.fetch(query, timeout=timeout)
+
+    async def copy_records_to_table(self, table_name: str, *,
+                                    records: Iterable[Sequence],
+                                    columns: Optional[Sequence[str]] = None,
+                                    timeout: Optional[float] = None) -> str:
+        await self.fetch('COPY %s' % table_name, timeout=timeout)
+        return 'COPY %d' % len(list(records))
+
+
+class _FakeAcquire:
+
+    def __init__(self, db: 'FakePostgres') -> None:
+        self._db = db
+        self._conn: Optional[FakeConnection] = None
+
+    async def __aenter__(self) -> Connection:
+        await self._db._slots.acquire()  # type: ignore
+        self._conn = self._db._idle.pop()
+        # bypasses the constructor of the aioapp connection, only its
+        # asyncpg connection is used by Result
+        conn = Connection.__new__(Connection)
+        conn._conn = self._conn
+        return conn
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        self._conn._pool_release_ctr += 1  # type: ignore
+        self._db._idle.append(self._conn)  # type: ignore
+        self._db._slots.release()  # type: ignore
+
+
+class FakePostgres(Postgres):
+    """
+    ``Postgres`` component whose pool is ``pool_size`` fake connections,
+    handed out most recently released first like the ``asyncpg`` pool. The
+    statements of the registry are prepared on every connection.
+    """
+
+    def __init__(self, latency: float, pool_size: int,
+                 rows: Optional[Dict[str, RowsFactory]] = None,
+                 statements: Optional[StatementRegistry] = None) -> None:
+        super(FakePostgres, self).__init__(url='postgres://fake/',
+                                           pool_min_size=pool_size,
+                                           pool_max_size=pool_size,
+                                           statements=statements)
+        self.latency = latency
+        self.pool_size = pool_size
+        self.rows = default_rows() if rows is None else rows
+        self.queries = 0
+        self.prepares = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._idle: List[FakeConnection] = []
+
+    async def prepare(self) -> None:
+        self._slots = asyncio.Semaphore(self.pool_size, loop=self.loop)
+        self._idle = [FakeConnection(self) for _ in range(self.pool_size)]
+        for conn in self._idle:
+            await self._init_connection(conn)  # type: ignore
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    def _acquire(self, ctx: Span) -> _FakeAcquire:  # type: ignore
+        return _FakeAcquire(self)
+
+    async def ping(self, timeout: Optional[float] = None) -> None:
+        await asyncio.sleep(self.latency, loop=self.loop)
+
+
+class FakeAmqpChannel:
+    """
+    Stand-in for the ``aioamqp`` channel behind an ``aioapp`` channel.
+    Deliveries past ``prefetch_count`` unacknowledged ones wait for acks.
+    """
+
+    def __init__(self, broker: 'FakeAmqp') -> None:
+        self._broker = broker
+        self.is_open = True
+        self.prefetch_count = 0
+        self.unacked: Set[int] = set()
+        self._backlog: Deque[Tuple[Callable, str, bytes]] = deque()
+
+    async def basic_qos(self, prefetch_count: int = 0,
+                        **kwargs: Any) -> None:
+        self.prefetch_count = prefetch_count
+
+    def deliver(self, fn: Callable, queue: str, body: bytes) -> None:
+        if self.prefetch_count and len(self.unacked) >= self.prefetch_count:
+            self._backlog.append((fn, queue, body))
+            return
+        tag = next(self._broker._delivery_seq)
+        self.unacked.add(tag)
+        envelope = AmqpEnvelope('fake', tag, '', queue, False)
+        asyncio.ensure_future(fn(NOOP_SPAN, self, body, envelope,
+                                 AmqpProperties()), loop=self._broker.loop)
+
+    def ack(self, delivery_tag: int, multiple: bool) -> None:
+        if multiple:
+            self.unacked = {tag for tag in self.unacked if tag > delivery_tag}
+        else:
+            self.unacked.discard(delivery_tag)
+        while self._backlog and (len(self.unacked) < self.prefetch_count):
+            self.deliver(*self._backlog.popleft())
+
+    async def confirm_select(self) -> None:
+        pass
+
+    async def publish(self, payload: bytes, exchange_name: str,
+                      routing_key: str, properties: Optional[dict] = None,
+                      mandatory: bool = False,
+                      immediate: bool = False) -> None:
+        await asyncio.sleep(self._broker.latency, loop=self._broker.loop)
+        nacks = self._broker.nacks.get(payload, 0)
+        if nacks:
+            self._broker.nacks[payload] = nacks - 1
+            raise PublishFailed(0)
+        self._broker.published.append(payload)
+        self._broker.deliver(routing_key, payload)
+
+    async def close(self) -> None:
+        self.is_open = False
+
+
+class FakeChannel(aioapp.amqp.Channel):
+    """
+    Replaces the broker side of ``aioapp.amqp.Channel``. It is mixed in
+    between an application channel class and ``aioapp.amqp.Channel`` by
+    ``FakeAmqp``, so the overrides of the application channels still run.
+    """
+    amqp: 'FakeAmqp'
+
+    async def open(self) -> None:
+        self._channel = FakeAmqpChannel(self.amqp)
+
+    async def _safe_declare_queue(self, queue_name: str = '',
+                                  **kwargs: Any) -> dict:
+        return {'queue': queue_name or self.amqp.new_queue_name()}
+
+    async def consume(self, fn: Callable, queue: str,
+                      **kwargs: Any) -> None:
+        self.amqp.consumers[queue] = (self, fn)
+
+    async def ack(self, ctx: Span, delivery_tag: int,
+                  multiple: bool = False, **kwargs: Any) -> None:
+        self.amqp.acks += 1
+        self._channel.ack(delivery_tag, multiple)
+
+    async def publish(self, ctx: Span, payload: bytes,
+                      exchange_name: str, routing_key: str,
+                      properties: Optional[dict] = None,
+                      mandatory: bool = False, immediate: bool = False,
+                      tracer_config: Any = None,
+                      propagate_trace: bool = True,
+                      retry: bool = True) -> None:
+        await self._channel.publish(payload, exchange_name, routing_key,
+                                    properties=properties,
+                                    mandatory=mandatory,
+                                    immediate=immediate)
+
+    async def stop(self) -> None:
+        await self._channel.close()
+
+
+def _fake_channel_class(cls: Type[aioapp.amqp.Channel]) -> type:
+    return type('Fake%s' % cls.__name__, (cls, FakeChannel), {})
+
+
+class FakeAmqp(aioapp.app.Component):
+    """
+    RabbitMq stand-in routing every published message to the consumer of
+    the queue named by its routing key, ``latency`` seconds after the
+    publish, within the prefetch count of the consumer. A payload in
+    ``nacks`` is nacked that many times before it is accepted.
+    """
+
+    def __init__(self, channels: List[aioapp.amqp.Channel],
+                 latency: float) -> None:
+        super(FakeAmqp, self).__init__()
+        self._channels = {ch.name: ch for ch in channels}
+        self.latency = latency
+        self.consumers: Dict[str, Tuple[FakeChannel, Callable]] = {}
+        self.acks = 0
+        self.published: List[bytes] = []
+        self.nacks: Dict[bytes, int] = {}
+        self._queue_seq = itertools.count(1)
+        self._delivery_seq = itertools.count(1)
+
+    def channel(self, name: str) -> aioapp.amqp.Channel:
+        return self._channels[name]
+
+    def new_queue_name(self) -> str:
+        return 'amq.gen-%d' % next(self._queue_seq)
+
+    async def prepare(self) -> None:
+        for ch in self._channels.values():
+            ch.__class__ = _fake_channel_class(type(ch))
+            ch.amqp = self  # type: ignore
+
+    async def start(self) -> None:
+        for ch in self._channels.values():
+            await ch.start()  # type: ignore
+
+    async def stop(self) -> None:
+        for ch in self._channels.values():
+            await ch.stop()  # type: ignore
+
+    def deliver(self, queue: str, body: bytes) -> None:
+        consumer = self.consumers.get(queue)
+        if consumer is None:
+            return
+        ch, fn = consumer
+        ch._channel.deliver(fn, queue, body)
+
+
+class BenchApplication(myaioapp.app.Application):
+    """
+    ``Application`` with Postgres and RabbitMq replaced by the fakes and the
+    demo consumer handler replaced by one taking ``consumer_latency``
+    seconds.
+    """
+
+    def __init__(self, config: Config,
+                 db_latency: float = 0.001,
+                 amqp_latency: float = 0.0005,
+                 consumer_latency: float = 0.,
+                 loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        self.db_latency = db_latency
+        self.amqp_latency = amqp_latency
+        self.consumer_latency = consumer_latency
+        super(BenchApplication, self).__init__(config, loop)
+
+    def add(self, name: str, comp: aioapp.app.Component,
+            stop_after: Optional[List[str]] = None,
+            start_after: Optional[List[str]] = None) -> None:
+        if name == myaioapp.app.POSTGRES:
+            comp = FakePostgres(self.db_latency,
+                                self.config.db_pool_max_size,
+                                statements=comp.statements)  # type: ignore
+        elif name == myaioapp.app.RABBIT:
+            consumer = comp.channel(AmqpConsumerChannel.name)  # type: ignore
+            consumer.process = self._process  # type: ignore
+            comp = FakeAmqp(
+                [consumer,
+                 comp.channel(AmqpPublisherChannel.name)],  # type: ignore
+                self.amqp_latency)
+        super(BenchApplication, self).add(name, comp, stop_after=stop_after,
+                                          start_after=start_after)
+
+    async def _process(self, ctx: Span, channel: Any, body: bytes,
+                       envelope: AmqpEnvelope,
+                       properties: AmqpProperties) -> None:
+        if self.consumer_latency:
+            await asyncio.sleep(self.consumer_latency, loop=self.loop)
+        self.rmq_consumer.message_counter += 1
@@ -0,0 +1,265 @@
+"""
+Benchmarks the application against the in-process fakes of ``fakes``.
+
+Drives ``GET /`` and the consumer path at a fixed concurrency and prints
+throughput and latency percentiles as JSON. The query result caches are
+disabled unless ``--cache`` is given, so every request reaches the fake
+database. A second, shorter pass under ``tracemalloc`` reports the memory
+the requests left allocated and the peak traced memory. ``tracemalloc``
+only sees live blocks, so these are not counts of every allocation. With
+``--baseline`` the run fails if it is slower than a previous report by
+more than ``--threshold``.
+
+    python -m benchmarks.run --requests 5000 --concurrency 50 \\
+        --output bench.json
+    python -m benchmarks.run --baseline bench.json --threshold 0.1
+"""
+import gc
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tracemalloc
+from typing import Any, Awaitable, Callable, Dict, List
+import aiohttp
+from myaioapp.config import Config
+from myaioapp.logic.db import GetDate, GetWeek
+from myaioapp.tracing import NOOP_SPAN
+from .fakes import BenchApplication
+
+PERCENTILES = (50, 90, 99)
+
+
+def parse_argv(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run')
+    parser.add_argument('--requests', type=int, default=2000,
+                        help='number of requests and of consumed messages')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=200,
+                        help='number of requests sent before measuring')
+    parser.add_argument('--db-latency', type=float, default=0.001,
+                        help='seconds each query takes')
+    parser.add_argument('--amqp-latency', type=float, default=0.0005,
+                        help='seconds each publish takes')
+    parser.add_argument('--consumer-latency', type=float, default=0.,
+                        help='seconds the consumer handles a message')
+    parser.add_argument('--cache', action='store_true',
+                        help='keep the query result caches enabled')
+    parser.add_argument('--memory-requests', type=int, default=500,
+                        help='number of requests and of consumed messages '
+                             'of the tracemalloc pass, 0 to skip it')
+    parser.add_argument('--output', help='write the report to this file')
+    parser.add_argument('--baseline', help='report to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='tolerated relative slowdown against the '
+                             'baseline')
+    return parser.parse_args(argv)
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def summary(latencies: List[float], duration: float) -> Dict[str, Any]:
+    latencies = sorted(latencies)
+    count = len(latencies)
+    report: Dict[str, Any] = {
+        'count': count,
+        'duration': round(duration, 4),
+        'throughput': round(count / duration, 2),
+    }
+    for pct in PERCENTILES:
+        idx = min(count - 1, int(count * pct / 100))
+        report['p%d_ms' % pct] = round(latencies[idx] * 1000, 3)
+    report['max_ms'] = round(latencies[-1] * 1000, 3)
+    return report
+
+
+async def drive(count: int, concurrency: int,
+                call: Callable[[], Awaitable[Any]]) -> Dict[str, Any]:
+    """
+    Awaits ``call`` ``count`` times from ``concurrency`` concurrent
+    workers and summarizes the latencies.
+    """
+    latencies: List[float] = []
+    remaining = iter(range(count))
+
+    async def worker() -> None:
+        for _ in remaining:
+            started = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return summary(latencies, time.perf_counter() - started)
+
+
+async def trace_memory(count: int, concurrency: int,
+                       call: Callable[[], Awaitable[Any]]) -> Dict[str, Any]:
+    """
+    Same as ``drive`` under ``tracemalloc``, which slows every allocation
+    down, and reports the blocks and memory the calls left allocated, and
+    the peak traced memory.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        await drive(count, concurrency, call)
+        gc.collect()
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    ignore = (tracemalloc.Filter(False, tracemalloc.__file__),)
+    diff = after.filter_traces(ignore).compare_to(
+        before.filter_traces(ignore), 'filename')
+    return {
+        'memory_retained_blocks': sum(stat.count_diff for stat in diff),
+        'memory_retained_kib': round(
+            sum(stat.size_diff for stat in diff) / 1024, 1),
+        'memory_peak_kib': round(peak / 1024, 1),
+    }
+
+
+async def bench_http(app: BenchApplication,
+                     options: argparse.Namespace) -> Dict[str, Any]:
+    url = 'http://127.0.0.1:%d/' % app.config.http_port
+    connector = aiohttp.TCPConnector(limit=options.concurrency,
+                                     loop=app.loop)
+    async with aiohttp.ClientSession(connector=connector,
+                                     loop=app.loop) as session:
+        async def request() -> None:
+            async with session.get(url) as resp:
+                await resp.read()
+                if resp.status != 200:
+                    raise UserWarning('GET / responded with %s'
+                                      '' % resp.status)
+
+        await drive(options.warmup, options.concurrency, request)
+        report = await drive(options.requests, options.concurrency, request)
+        if options.memory_requests:
+            report.update(await trace_memory(options.memory_requests,
+                                             options.concurrency, request))
+        return report
+
+
+async def bench_consumer(app: BenchApplication,
+                         options: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Publishes ``--requests`` messages to the consumer queue and measures
+    each one from the publish to the end of its handling.
+    """
+    consumer = app.rmq_consumer
+    waiters: Dict[bytes, asyncio.Future] = {}
+    seq = iter(range(sys.maxsize))
+    process = app._process
+
+    async def process_and_notify(ctx: Any, channel: Any, body: bytes,
+                                 *args: Any) -> None:
+        await process(ctx, channel, body, *args)
+        waiter = waiters.pop(body, None)
+        if waiter is not None:
+            waiter.set_result(None)
+
+    consumer.process = process_and_notify  # type: ignore
+
+    async def message() -> None:
+        body = b'%d' % next(seq)
+        waiter = waiters[body] = app.loop.create_future()
+        await app.rmq_publisher.publish(NOOP_SPAN,  # type: ignore
+                                        body, '', consumer.queue,
+                                        propagate_trace=False)
+        await waiter
+
+    report = await drive(options.requests, options.concurrency, message)
+    if options.memory_requests:
+        report.update(await trace_memory(options.memory_requests,
+                                         options.concurrency, message))
+    return report
+
+
+def regressions(report: Dict[str, Any], baseline: Dict[str, Any],
+                threshold: float) -> List[str]:
+    found = []
+    for name, cur in report.items():
+        base = baseline.get(name)
+        if name == 'params' or not base:
+            continue
+        if cur['throughput'] < base['throughput'] * (1 - threshold):
+            found.append('%s throughput %.2f < %.2f' % (
+                name, cur['throughput'], base['throughput']))
+        if cur['p99_ms'] > base['p99_ms'] * (1 + threshold):
+            found.append('%s p99 %.3fms > %.3fms' % (
+                name, cur['p99_ms'], base['p99_ms']))
+    return found
+
+
+async def run(options: argparse.Namespace,
+              loop: asyncio.AbstractEventLoop) -> Dict[str, Any]:
+    config = Config({
+        'HTTP_HOST': '127.0.0.1',
+        'HTTP_PORT': free_port(),
+        'DB_URL': 'postgres://fake/',
+        'RABBIT_URL': 'amqp://fake/',
+    })
+    caches = {cls: cls.__cache__ for cls in (GetDate, GetWeek)}
+    for cls, cache in caches.items():
+        if cache is not None:
+            cache.clear()
+        if not options.cache:
+            cls.__cache__ = None
+    app = BenchApplication(config,
+                           db_latency=options.db_latency,
+                           amqp_latency=options.amqp_latency,
+                           consumer_latency=options.consumer_latency,
+                           loop=loop)
+    await app.run_prepare()
+    try:
+        http = await bench_http(app, options)
+        consumer = await bench_consumer(app, options)
+    finally:
+        await app.run_shutdown()
+        for cls, cache in caches.items():
+            cls.__cache__ = cache
+    return {
+        'params': {
+            'requests': options.requests,
+            'concurrency': options.concurrency,
+            'db_latency': options.db_latency,
+            'amqp_latency': options.amqp_latency,
+            'consumer_latency': options.consumer_latency,
+            'cache': options.cache,
+            'loop': type(loop).__module__,
+        },
+        'http': http,
+        'consumer': consumer,
+    }
+
+
+def main(argv: List[str]) -> int:
+    options = parse_argv(argv)
+    loop = asyncio.get_event_loop()
+    report = loop.run_until_complete(run(options, loop))
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(text + '\n')
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        found = regressions(report, baseline, options.threshold)
+        for line in found:
+            print('REGRESSION: %s' % line, file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
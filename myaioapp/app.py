@@ -1,13 +1,31 @@
+import time
 import asyncio
-from typing import Optional
+import logging
+from typing import Awaitable, Dict, List, Optional
 import aioapp
+import myaioapp.logic.db
 from myaioapp.config import Config
+from myaioapp.logic.db import Postgres, StatementRegistry
 from myaioapp.logic.http import MainHttpHandler
 from myaioapp.logic.amqp import AmqpConsumerChannel, AmqpPublisherChannel
+from myaioapp.logic.fanout import fanout
+from myaioapp.logic.health import HealthChecker
+from myaioapp.logic.outbox import OutboxRelay
+from myaioapp.metrics import MetricsFlusher
+from myaioapp.monitor import LoopMonitor
+from myaioapp.profiling import Profiler
+from myaioapp.tracing import SpanExporter, TraceSampler, create_sampler
 
 HTTP_SERVER = 'http_server'
 POSTGRES = 'postgres'
 RABBIT = 'rabbit'
+HEALTH = 'health'
+OUTBOX = 'outbox'
+METRICS = 'metrics'
+TRACER = 'tracer'
+LOOP_MONITOR = 'loop_monitor'
+
+logger = logging.getLogger(__name__)
 
 
 class Application(aioapp.app.Application):
@@ -15,6 +33,24 @@ class Application(aioapp.app.Application):
                  loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
         super(Application, self).__init__(loop)
         self.config = config
+        self.startup_timings: Dict[str, float] = {}
+        self._start_deps: Dict[str, List[str]] = {}
+        self.tracing = TraceSampler(
+            create_sampler(config.tracer_sampler,
+                           config.tracer_sampler_param),
+            slow_threshold=config.tracer_slow_threshold,
+            keep_errors=config.tracer_keep_errors
+        )
+        self.profiler: Optional[Profiler] = None
+        if config.profile_dir:
+            self.profiler = Profiler(
+                config.profile_dir,
+                max_files=config.profile_max_files,
+                sample_rate=config.profile_sample_rate,
+                slow_threshold=config.profile_slow_threshold,
+                token=config.profile_token,
+                loop=self.loop
+            )
         # -------------- HTTP SERVER --------------
         self.add(
             HTTP_SERVER,
@@ -22,42 +58,124 @@ class Application(aioapp.app.Application):
                 config.http_host,
                 config.http_port,
                 MainHttpHandler
-            )
+            ),
+            start_after=[RABBIT, POSTGRES, HEALTH]
+        )
+        # -------------- HEALTH --------------
+        self.add(
+            HEALTH,
+            HealthChecker(
+                interval=self.config.health_check_interval,
+                timeout=self.config.health_check_timeout
+            ),
+            start_after=[RABBIT, POSTGRES],
+            stop_after=[HTTP_SERVER]
         )
         # -------------- RABBIT --------------
         _rmqma = self.config.rabbit_prepare_connect_max_attempts
         _rmqri = self.config.rabbit_prepare_connect_retry_interval
+        _rmqab = self.config.rabbit_consumer_ack_batch_size
+        _rmqad = self.config.rabbit_consumer_ack_max_delay
+        _rmqmf = self.config.rabbit_publisher_max_in_flight
+        _rmqbs = self.config.rabbit_publisher_batch_size
+        _rmqbd = self.config.rabbit_publisher_batch_max_delay
         self.add(
             RABBIT,
             aioapp.amqp.Amqp(
                 url=self.config.rabbit_url,
                 channels=[
-                    AmqpConsumerChannel(),
-                    AmqpPublisherChannel(),
+                    AmqpConsumerChannel(
+                        prefetch_count=self.config.rabbit_consumer_prefetch,
+                        concurrency=self.config.rabbit_consumer_concurrency,
+                        ack_batch_size=_rmqab,
+                        ack_max_delay=_rmqad
+                    ),
+                    AmqpPublisherChannel(
+                        confirms=self.config.rabbit_publisher_confirms,
+                        max_in_flight=_rmqmf,
+                        batch_size=_rmqbs,
+                        batch_max_delay=_rmqbd
+                    ),
                 ],
                 heartbeat=self.config.rabbit_heartbeat,
                 connect_max_attempts=_rmqma,
                 connect_retry_delay=_rmqri
             ),
-            stop_after=[HTTP_SERVER]
+            stop_after=[HTTP_SERVER, HEALTH, OUTBOX]
         )
         # -------------- POSTGRS --------------
         _pglt = self.config.db_pool_max_inactive_connection_lifetime
         _pgma = self.config.db_prepare_connect_max_attempts
         _pgri = self.config.db_prepare_connect_retry_interval
+        _pgru = [url.strip()
+                 for url in (self.config.db_replica_urls or '').split(',')
+                 if url.strip()]
         self.add(
             POSTGRES,
-            aioapp.db.Postgres(
+            Postgres(
                 url=self.config.db_url,
                 pool_min_size=self.config.db_pool_min_size,
                 pool_max_size=self.config.db_pool_max_size,
                 pool_max_queries=self.config.db_pool_max_queries,
                 pool_max_inactive_connection_lifetime=_pglt,
                 connect_max_attempts=_pgma,
-                connect_retry_delay=_pgri
+                connect_retry_delay=_pgri,
+                statements=StatementRegistry(myaioapp.logic.db),
+                replica_urls=_pgru,
+                replica_max_lag=self.config.db_replica_max_lag,
+                replica_check_interval=self.config.db_replica_check_interval,
+                pool_adaptive=self.config.db_pool_adaptive,
+                pool_adjust_interval=self.config.db_pool_adjust_interval,
+                pool_target_wait=self.config.db_pool_target_wait,
+                pool_max_saturation=self.config.db_pool_max_saturation
             ),
-            stop_after=[HTTP_SERVER, RABBIT]
+            stop_after=[HTTP_SERVER, RABBIT, HEALTH, OUTBOX]
+        )
+        # -------------- OUTBOX --------------
+        self.add(
+            OUTBOX,
+            OutboxRelay(
+                batch_size=self.config.outbox_batch_size,
+                interval=self.config.outbox_interval,
+                lease=self.config.outbox_lease
+            ),
+            start_after=[RABBIT, POSTGRES],
+            stop_after=[HTTP_SERVER]
         )
+        # -------------- METRICS --------------
+        if self.config.metrics_flush_interval and self.config.metrics_url:
+            self.add(
+                METRICS,
+                MetricsFlusher(
+                    url=self.config.metrics_url,
+                    prefix=self.config.metrics_name,
+                    interval=self.config.metrics_flush_interval
+                ),
+                stop_after=[HTTP_SERVER, RABBIT, POSTGRES]
+            )
+        # -------------- LOOP MONITOR --------------
+        if self.config.loop_monitor_interval:
+            self.add(
+                LOOP_MONITOR,
+                LoopMonitor(
+                    interval=self.config.loop_monitor_interval,
+                    threshold=self.config.loop_monitor_threshold
+                ),
+                stop_after=[HTTP_SERVER, RABBIT, POSTGRES, OUTBOX]
+            )
+        # -------------- TRACER --------------
+        if self.config.tracer_driver == 'zipkin' and self.config.tracer_url:
+            self.add(
+                TRACER,
+                SpanExporter(
+                    url=self.config.tracer_url,
+                    batch_size=self.config.tracer_export_batch_size,
+                    interval=self.config.tracer_export_interval,
+                    max_queue_size=self.config.tracer_export_queue_size,
+                    timeout=self.config.tracer_export_timeout
+                ),
+                stop_after=[HTTP_SERVER, RABBIT, POSTGRES, HEALTH]
+            )
         self.setup_logging(
             tracer_driver=config.tracer_driver,
             tracer_name=config.tracer_name,
@@ -67,15 +185,84 @@ class Application(aioapp.app.Application):
             metrics_addr=config.metrics_url,
             metrics_name=config.metrics_name
         )
+        self.tracing.install(getattr(self, 'tracer', None))
+
+    def add(self, name: str, comp: aioapp.app.Component,
+            stop_after: Optional[List[str]] = None,
+            start_after: Optional[List[str]] = None) -> None:
+        super(Application, self).add(name, comp, stop_after=stop_after)
+        self._start_deps[name] = list(start_after or [])
+
+    async def run_prepare(self) -> None:
+        """
+        Prepares all components concurrently and starts each one as soon
+        as the components listed in its ``start_after`` have started.
+        """
+        self._check_start_deps()
+        started = time.monotonic()
+        tasks: Dict[str, asyncio.Future] = {}
+        for name in self._components:
+            tasks[name] = asyncio.ensure_future(
+                self._run_component(name, tasks), loop=self.loop)
+        await fanout(*tasks.values(), loop=self.loop)
+        self.startup_timings['total'] = time.monotonic() - started
+        logger.info('Startup timings: %s', ', '.join(
+            '%s=%.3fs' % item for item in self.startup_timings.items()))
+
+    async def _run_component(self, name: str,
+                             tasks: Dict[str, asyncio.Future]) -> None:
+        comp = self._components[name]
+        await self._timed('%s.prepare' % name, comp.prepare())
+        deps = [tasks[dep] for dep in self._start_deps.get(name, [])]
+        if deps:
+            await asyncio.wait(deps, loop=self.loop)
+            for dep in deps:
+                if dep.cancelled() or dep.exception() is not None:
+                    return
+        await self._timed('%s.start' % name, comp.start())
+
+    def _check_start_deps(self) -> None:
+        visited: Dict[str, bool] = {}
+
+        def visit(name: str, path: List[str]) -> None:
+            if visited.get(name):
+                return
+            if name in path:
+                raise UserWarning('Circular start_after dependency: %s'
+                                  '' % ' -> '.join(path + [name]))
+            for dep in self._start_deps.get(name, []):
+                if dep not in self._components:
+                    raise UserWarning('Component %r starts after unknown '
+                                      'component %r' % (name, dep))
+                visit(dep, path + [name])
+            visited[name] = True
+
+        for name in self._components:
+            visit(name, [])
+
+    async def _timed(self, stage: str, coro: Awaitable) -> None:
+        started = time.monotonic()
+        try:
+            await coro
+        finally:
+            self.startup_timings[stage] = time.monotonic() - started
 
     @property
     def http_server(self) -> aioapp.http.Server:
         return self._components[HTTP_SERVER]  # type: ignore
 
     @property
-    def db(self) -> aioapp.db.Postgres:
+    def db(self) -> Postgres:
         return self._components[POSTGRES]  # type: ignore
 
+    @property
+    def health(self) -> HealthChecker:
+        return self._components[HEALTH]  # type: ignore
+
+    @property
+    def outbox(self) -> OutboxRelay:
+        return self._components[OUTBOX]  # type: ignore
+
     @property
     def rmq(self) -> aioapp.amqp.Amqp:
         return self._components[RABBIT]  # type: ignore
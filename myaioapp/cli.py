@@ -5,9 +5,11 @@ import asyncio
 import argparse
 from aioapp.config import ConfigError
 from .config import Config
-from typing import NamedTuple
+from typing import NamedTuple, Optional
 import myaioapp
 import myaioapp.app
+import myaioapp.logic.db
+from .supervisor import Supervisor
 
 
 class Args(NamedTuple):
@@ -15,6 +17,9 @@ class Args(NamedTuple):
     config: bool
     log_level: str
     log_file: str
+    workers: Optional[int] = None
+    loop: Optional[str] = None
+    migrate: bool = False
 
 
 def parse_argv(prog: str, options: list) -> Args:
@@ -53,9 +58,35 @@ def parse_argv(prog: str, options: list) -> Args:
         type=str,
         help='Logging file name',
     )
+
+    parser.add_argument(
+        '-w',
+        '--workers',
+        dest='workers',
+        type=int,
+        help='Number of worker processes sharing the HTTP port '
+             '(overrides WORKERS)',
+    )
+
+    parser.add_argument(
+        '--loop',
+        dest='loop',
+        type=str,
+        choices=['asyncio', 'uvloop'],
+        help='Event loop implementation (overrides EVENT_LOOP)',
+    )
+
+    parser.add_argument(
+        '--migrate',
+        action="store_true",
+        default=False,
+        help="apply the pending database migrations and exit",
+    )
     parsed = parser.parse_args(args=options)
     return Args(version=parsed.version, log_level=parsed.log_level,
-                log_file=parsed.log_file, config=parsed.config)
+                log_file=parsed.log_file, config=parsed.config,
+                workers=parsed.workers, loop=parsed.loop,
+                migrate=parsed.migrate)
 
 
 def setup_logging(options: Args) -> None:
@@ -65,6 +96,23 @@ def setup_logging(options: Args) -> None:
     logging.basicConfig(**config)
 
 
+def setup_loop(name: str) -> str:
+    """
+    Installs the event loop policy of the named implementation and returns
+    the name of the one actually installed, falling back to asyncio when
+    uvloop is not available.
+    """
+    if name != 'uvloop':
+        return 'asyncio'
+    try:
+        import uvloop
+    except ImportError:
+        logging.warning('uvloop is not installed, using asyncio')
+        return 'asyncio'
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return 'uvloop'
+
+
 def main() -> int:
     try:
         prog, args = sys.argv[0], sys.argv[1:]
@@ -82,11 +130,31 @@ def main() -> int:
         except ConfigError as e:
             print(e, file=sys.stderr)
             return 1
+        setup_loop(options.loop or config.event_loop)
+        if options.migrate:
+            return migrate(config)
+        workers = options.workers or config.workers
+        if workers > 1:
+            try:
+                supervisor = Supervisor(config, workers, run)
+            except ConfigError as e:
+                print(e, file=sys.stderr)
+                return 1
+            return supervisor.run()
         return run(config)
     except KeyboardInterrupt:  # pragma: no cover
         return 0
 
 
+def migrate(config: Config) -> int:
+    loop = asyncio.get_event_loop()
+    applied = loop.run_until_complete(
+        myaioapp.logic.db.migrate(config.db_url, loop=loop))
+    for name in applied:
+        logging.info('Applied migration %s', name)
+    return 0
+
+
 def run(config: Config) -> int:
     loop = asyncio.get_event_loop()
     app = myaioapp.app.Application(config, loop)
@@ -2,27 +2,82 @@ from aioapp.config import Config as AioappConfig
 
 
 class Config(AioappConfig):
+    event_loop: str
+    workers: int
     http_host: str
     http_port: int
+    http_request_timeout: float
+    http_shed_pool_waiting: int
+    health_check_interval: float
+    health_check_timeout: float
     db_url: str
     db_pool_min_size: int
     db_pool_max_size: int
     db_pool_max_queries: int
     db_pool_max_inactive_connection_lifetime: float
+    db_pool_adaptive: bool
+    db_pool_adjust_interval: float
+    db_pool_target_wait: float
+    db_pool_max_saturation: float
     db_prepare_connect_max_attempts: int
     db_prepare_connect_retry_interval: float
+    db_replica_urls: str
+    db_replica_max_lag: float
+    db_replica_check_interval: float
     rabbit_url: str
     rabbit_heartbeat: int
     rabbit_prepare_connect_max_attempts: int
     rabbit_prepare_connect_retry_interval: float
+    rabbit_consumer_prefetch: int
+    rabbit_consumer_concurrency: int
+    rabbit_consumer_ack_batch_size: int
+    rabbit_consumer_ack_max_delay: float
+    rabbit_publisher_confirms: bool
+    rabbit_publisher_max_in_flight: int
+    rabbit_publisher_batch_size: int
+    rabbit_publisher_batch_max_delay: float
+    outbox_batch_size: int
+    outbox_interval: float
+    outbox_lease: float
     tracer_driver: str
     tracer_name: str
     tracer_url: str
     tracer_default_sampled: bool
+    tracer_sampler: str
+    tracer_sampler_param: float
+    tracer_slow_threshold: float
+    tracer_keep_errors: bool
+    tracer_export_batch_size: int
+    tracer_export_interval: float
+    tracer_export_queue_size: int
+    tracer_export_timeout: float
     metrics_driver: str
     metrics_name: str
     metrics_url: str
+    metrics_flush_interval: float
+    loop_monitor_interval: float
+    loop_monitor_threshold: float
+    profile_dir: str
+    profile_max_files: int
+    profile_sample_rate: float
+    profile_slow_threshold: float
+    profile_token: str
     _vars = {
+        'event_loop': {
+            'type': str,
+            'name': 'EVENT_LOOP',
+            'descr': 'Event loop implementation: asyncio or uvloop. Falls '
+                     'back to asyncio if uvloop is not installed.',
+            'default': 'asyncio',
+        },
+        'workers': {
+            'type': int,
+            'name': 'WORKERS',
+            'descr': 'Number of worker processes sharing the HTTP port. '
+                     'DB_POOL_MAX_SIZE is split between them.',
+            'default': 1,
+            'min': 1,
+        },
         'http_host': {
             'type': str,
             'name': 'HTTP_HOST',
@@ -37,6 +92,39 @@ class Config(AioappConfig):
             'min': 1,
             'max': 65535,
         },
+        'http_request_timeout': {
+            'type': float,
+            'name': 'HTTP_REQUEST_TIMEOUT',
+            'descr': 'Time budget in seconds of the database queries of a '
+                     'request. A request running out of it gets a 503 '
+                     'response. Pass 0 to disable.',
+            'default': 5.0,
+            'min': 0.,
+        },
+        'http_shed_pool_waiting': {
+            'type': int,
+            'name': 'HTTP_SHED_POOL_WAITING',
+            'descr': 'Number of requests waiting for a database connection '
+                     'above which new requests get a 503 response right '
+                     'away. Pass 0 to disable.',
+            'default': 100,
+            'min': 0,
+        },
+        'health_check_interval': {
+            'type': float,
+            'name': 'HEALTH_CHECK_INTERVAL',
+            'descr': 'Interval between background checks of Postgres and '
+                     'RabbitMq reported by /health/ready',
+            'default': 5.0,
+            'min': 0.1,
+        },
+        'health_check_timeout': {
+            'type': float,
+            'name': 'HEALTH_CHECK_TIMEOUT',
+            'descr': 'Timeout of a single Postgres health check',
+            'default': 1.0,
+            'min': 0.001,
+        },
         'db_url': {
             'type': str,
             'name': 'DB_URL',
@@ -75,6 +163,39 @@ class Config(AioappConfig):
             'default': 300.0,
             'min': 0.,
         },
+        'db_pool_adaptive': {
+            'type': bool,
+            'name': 'DB_POOL_ADAPTIVE',
+            'descr': 'Start with DB_POOL_MIN_SIZE usable connections and '
+                     'resize up to DB_POOL_MAX_SIZE from the pool wait time '
+                     'and the connections in use on the server',
+            'default': False,
+        },
+        'db_pool_adjust_interval': {
+            'type': float,
+            'name': 'DB_POOL_ADJUST_INTERVAL',
+            'descr': 'Interval in seconds between pool resizes and refreshes '
+                     'of the pool gauges',
+            'default': 5.0,
+            'min': 0.01,
+        },
+        'db_pool_target_wait': {
+            'type': float,
+            'name': 'DB_POOL_TARGET_WAIT',
+            'descr': 'Mean pool wait in seconds above which the adaptive pool '
+                     'grows',
+            'default': 0.005,
+            'min': 0.,
+        },
+        'db_pool_max_saturation': {
+            'type': float,
+            'name': 'DB_POOL_MAX_SATURATION',
+            'descr': 'Share of the server max_connections in use above which '
+                     'the adaptive pool stops growing',
+            'default': 0.9,
+            'min': 0.,
+            'max': 1.,
+        },
         'db_prepare_connect_max_attempts': {
             'type': int,
             'name': 'DB_PREPARE_CONNECT_MAX_ATTEMPTS',
@@ -89,6 +210,28 @@ class Config(AioappConfig):
             'default': 1.0,
             'min': 0.001,
         },
+        'db_replica_urls': {
+            'type': str,
+            'name': 'DB_REPLICA_URLS',
+            'descr': 'Comma separated connection strings of read replicas. '
+                     'Read-only queries are sent to them instead of DB_URL.',
+        },
+        'db_replica_max_lag': {
+            'type': float,
+            'name': 'DB_REPLICA_MAX_LAG',
+            'descr': 'Replication lag in seconds above which a replica is '
+                     'skipped',
+            'default': 10.0,
+            'min': 0.,
+        },
+        'db_replica_check_interval': {
+            'type': float,
+            'name': 'DB_REPLICA_CHECK_INTERVAL',
+            'descr': 'Interval between replication lag checks, also the '
+                     'time a failed replica is skipped for',
+            'default': 5.0,
+            'min': 0.001,
+        },
         'rabbit_url': {
             'type': str,
             'name': 'RABBIT_URL',
@@ -120,6 +263,95 @@ class Config(AioappConfig):
             'default': 1.0,
             'min': 0.001,
         },
+        'rabbit_consumer_prefetch': {
+            'type': int,
+            'name': 'RABBIT_CONSUMER_PREFETCH',
+            'descr': 'Number of unacknowledged messages the RabbitMq '
+                     'delivers to the consumer, at most '
+                     'RABBIT_CONSUMER_CONCURRENCY. Zero means '
+                     'RABBIT_CONSUMER_CONCURRENCY.',
+            'default': 0,
+            'min': 0,
+        },
+        'rabbit_consumer_concurrency': {
+            'type': int,
+            'name': 'RABBIT_CONSUMER_CONCURRENCY',
+            'descr': 'Number of messages the consumer processes in parallel',
+            'default': 10,
+            'min': 1,
+        },
+        'rabbit_consumer_ack_batch_size': {
+            'type': int,
+            'name': 'RABBIT_CONSUMER_ACK_BATCH_SIZE',
+            'descr': 'Number of processed messages the consumer acknowledges '
+                     'with a single frame',
+            'default': 10,
+            'min': 1,
+        },
+        'rabbit_consumer_ack_max_delay': {
+            'type': float,
+            'name': 'RABBIT_CONSUMER_ACK_MAX_DELAY',
+            'descr': 'Maximum number of seconds a processed message waits '
+                     'to be acknowledged',
+            'default': 0.05,
+            'min': 0.,
+        },
+        'rabbit_publisher_confirms': {
+            'type': bool,
+            'name': 'RABBIT_PUBLISHER_CONFIRMS',
+            'descr': 'Put the publisher channel into confirm mode, required '
+                     'by the outbox relay',
+            'default': True,
+        },
+        'rabbit_publisher_max_in_flight': {
+            'type': int,
+            'name': 'RABBIT_PUBLISHER_MAX_IN_FLIGHT',
+            'descr': 'Maximum number of published messages waiting for a '
+                     'confirm from the RabbitMq',
+            'default': 100,
+            'min': 1,
+        },
+        'rabbit_publisher_batch_size': {
+            'type': int,
+            'name': 'RABBIT_PUBLISHER_BATCH_SIZE',
+            'descr': 'Number of buffered messages the publisher sends in '
+                     'one batch',
+            'default': 100,
+            'min': 1,
+        },
+        'rabbit_publisher_batch_max_delay': {
+            'type': float,
+            'name': 'RABBIT_PUBLISHER_BATCH_MAX_DELAY',
+            'descr': 'Maximum number of seconds a buffered message waits to '
+                     'be published',
+            'default': 0.005,
+            'min': 0.,
+        },
+        'outbox_batch_size': {
+            'type': int,
+            'name': 'OUTBOX_BATCH_SIZE',
+            'descr': 'Maximum number of outbox messages claimed and '
+                     'published at once',
+            'default': 100,
+            'min': 1,
+        },
+        'outbox_interval': {
+            'type': float,
+            'name': 'OUTBOX_INTERVAL',
+            'descr': 'Interval between polls of the outbox table when no '
+                     'handler has notified the relay',
+            'default': 1.,
+            'min': 0.,
+        },
+        'outbox_lease': {
+            'type': float,
+            'name': 'OUTBOX_LEASE',
+            'descr': 'Number of seconds claimed outbox messages stay '
+                     'reserved for the relay before another one may claim '
+                     'them',
+            'default': 30.,
+            'min': 1.,
+        },
 
         'tracer_driver': {
             'type': str,
@@ -137,8 +369,72 @@ class Config(AioappConfig):
         'tracer_default_sampled': {
             'type': bool,
             'name': 'TRACER_DEFAULT_SAMPLED',
+            'descr': 'Sampling of the root spans the tracer creates outside '
+                     'of TRACER_SAMPLER. The root spans of the requests are '
+                     'sampled by TRACER_SAMPLER',
             'default': True,
         },
+        'tracer_sampler': {
+            'type': str,
+            'name': 'TRACER_SAMPLER',
+            'descr': 'Sampler of the request handler spans: const, '
+                     'probabilistic or ratelimiting',
+            'default': 'const',
+        },
+        'tracer_sampler_param': {
+            'type': float,
+            'name': 'TRACER_SAMPLER_PARAM',
+            'descr': 'const: 1 to trace every request and 0 for none, '
+                     'probabilistic: share of traced requests, '
+                     'ratelimiting: traced requests per second',
+            'default': 1.,
+            'min': 0.,
+        },
+        'tracer_slow_threshold': {
+            'type': float,
+            'name': 'TRACER_SLOW_THRESHOLD',
+            'descr': 'Keep the trace of an unsampled request taking at least '
+                     'this number of seconds. Pass 0 to disable',
+            'default': 0.,
+            'min': 0.,
+        },
+        'tracer_keep_errors': {
+            'type': bool,
+            'name': 'TRACER_KEEP_ERRORS',
+            'descr': 'Keep the trace of an unsampled request that failed',
+            'default': False,
+        },
+        'tracer_export_batch_size': {
+            'type': int,
+            'name': 'TRACER_EXPORT_BATCH_SIZE',
+            'descr': 'Maximum number of spans sent to the zipkin tracer in '
+                     'one request',
+            'default': 100,
+            'min': 1,
+        },
+        'tracer_export_interval': {
+            'type': float,
+            'name': 'TRACER_EXPORT_INTERVAL',
+            'descr': 'Interval between sending finished spans to the zipkin '
+                     'tracer',
+            'default': 1.,
+            'min': 0.,
+        },
+        'tracer_export_queue_size': {
+            'type': int,
+            'name': 'TRACER_EXPORT_QUEUE_SIZE',
+            'descr': 'Maximum number of spans waiting to be sent, further '
+                     'spans are dropped',
+            'default': 10000,
+            'min': 1,
+        },
+        'tracer_export_timeout': {
+            'type': float,
+            'name': 'TRACER_EXPORT_TIMEOUT',
+            'descr': 'Timeout of sending a batch of spans',
+            'default': 5.,
+            'min': 0.,
+        },
         'metrics_driver': {
             'type': str,
             'name': 'METRICS',
@@ -152,4 +448,64 @@ class Config(AioappConfig):
             'type': str,
             'name': 'METRICS_URL',
         },
+        'metrics_flush_interval': {
+            'type': float,
+            'name': 'METRICS_FLUSH_INTERVAL',
+            'descr': 'Interval between sending the aggregated metrics to '
+                     'METRICS_URL. Pass 0 to only expose them on /metrics.',
+            'default': 0.,
+            'min': 0.,
+        },
+        'loop_monitor_interval': {
+            'type': float,
+            'name': 'LOOP_MONITOR_INTERVAL',
+            'descr': 'Interval between event loop lag measurements. '
+                     'Pass 0 to disable',
+            'default': .1,
+            'min': 0.,
+        },
+        'loop_monitor_threshold': {
+            'type': float,
+            'name': 'LOOP_MONITOR_THRESHOLD',
+            'descr': 'Event loop lag in seconds reported as a blocked loop '
+                     'with the stack of the blocking code',
+            'default': .1,
+            'min': .01,
+        },
+        'profile_dir': {
+            'type': str,
+            'name': 'PROFILE_DIR',
+            'descr': 'Directory for the cProfile and tracemalloc captures of '
+                     'sampled requests. Profiling is disabled if not set',
+        },
+        'profile_max_files': {
+            'type': int,
+            'name': 'PROFILE_MAX_FILES',
+            'descr': 'Number of newest captures kept in PROFILE_DIR',
+            'default': 20,
+            'min': 1,
+        },
+        'profile_sample_rate': {
+            'type': float,
+            'name': 'PROFILE_SAMPLE_RATE',
+            'descr': 'Share of requests profiled',
+            'default': 0.,
+            'min': 0.,
+            'max': 1.,
+        },
+        'profile_slow_threshold': {
+            'type': float,
+            'name': 'PROFILE_SLOW_THRESHOLD',
+            'descr': 'Profile the next request of a route after one taking '
+                     'at least this number of seconds. Pass 0 to disable',
+            'default': 0.,
+            'min': 0.,
+        },
+        'profile_token': {
+            'type': str,
+            'name': 'PROFILE_TOKEN',
+            'descr': 'Value of the X-Profile header required to trigger a '
+                     'capture and to access /admin/profiles, which is not '
+                     'served without it',
+        },
     }
@@ -0,0 +1,80 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+from aioapp.tracer import Span
+
+AckFn = Callable[[Span, int, bool], Awaitable[Any]]
+
+
+class AckCoalescer:
+    """
+    Buffers the delivery tags of processed messages and acknowledges them
+    with ``multiple=True`` once ``max_pending`` tags are buffered or
+    ``max_delay`` seconds have passed since the first one.
+
+    Messages may complete in any order: only the longest run of completed
+    tags starting from the oldest delivery is acknowledged, so a message
+    still being processed is never acknowledged by a later one.
+    """
+
+    def __init__(self, ack: AckFn, max_pending: int, max_delay: float,
+                 loop: asyncio.AbstractEventLoop) -> None:
+        self._ack = ack
+        self.max_pending = max_pending
+        self.max_delay = max_delay
+        self.loop = loop
+        self._delivered: Deque[int] = deque()
+        self._completed: Dict[int, Span] = {}
+        self._lock = asyncio.Lock(loop=loop)
+        self._timer: Optional[asyncio.Handle] = None
+        self._flushing: Optional[asyncio.Future] = None
+
+    def delivered(self, delivery_tag: int) -> None:
+        self._delivered.append(delivery_tag)
+
+    def completed(self, ctx: Span, delivery_tag: int) -> None:
+        self._completed[delivery_tag] = ctx
+        if len(self._completed) >= self.max_pending:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = self.loop.call_later(self.max_delay,
+                                               self._schedule_flush)
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            ctx, last = None, None
+            while self._delivered and self._delivered[0] in self._completed:
+                last = self._delivered.popleft()
+                ctx = self._completed.pop(last)
+            if last is not None:
+                await self._ack(ctx, last, True)  # type: ignore
+            if self._completed and self._timer is None:
+                self._timer = self.loop.call_later(self.max_delay,
+                                                   self._schedule_flush)
+
+    async def close(self) -> None:
+        """
+        Acknowledges everything that has completed, including tags behind
+        a message that never finished, and forgets the rest.
+        """
+        if self._flushing is not None:
+            await self._flushing
+        await self.flush()
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            for tag in sorted(self._completed):
+                await self._ack(self._completed.pop(tag), tag, False)
+            self._delivered.clear()
+
+    def _schedule_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._flushing is None or self._flushing.done():
+            self._flushing = asyncio.ensure_future(self.flush(),
+                                                   loop=self.loop)
@@ -1,10 +1,14 @@
+import time
 import asyncio
-from typing import Optional
+from typing import List, Optional
 from aioapp.tracer import Span
 from aioapp.amqp import Channel, AmqpTracerConfig
 from aioamqp.channel import Channel as AmqpChannel
 from aioamqp.properties import Properties as AmqpProperties
 from aioamqp.envelope import Envelope as AmqpEnvelope
+from myaioapp.metrics import REGISTRY, Timer
+from myaioapp.tracing import is_recording
+from .acks import AckCoalescer
 
 
 class TracerConfig(AmqpTracerConfig):
@@ -16,6 +20,8 @@ class TracerConfig(AmqpTracerConfig):
     def on_ack_start(self, ctx: Span,
                      channel: AmqpChannel,
                      delivery_tag: str, multiple: bool):
+        if not is_recording(ctx):
+            return
         super(TracerConfig, self).on_ack_start(ctx, channel,
                                                delivery_tag, multiple)
 
@@ -27,23 +33,110 @@ class TracerConfig(AmqpTracerConfig):
 
 
 class AmqpConsumerChannel(Channel):
+    """
+    Consumes the messages of an exclusive queue with ``concurrency``
+    workers.
+
+    The broker stops delivering once ``prefetch_count`` messages are
+    unacknowledged, which is what bounds the messages in flight: zero
+    derives it from ``concurrency``, a larger value than ``concurrency`` is
+    rejected.
+    """
     name = 'consumer'
     queue: Optional[str]
     message_counter: int = 0
 
+    def __init__(self, prefetch_count: int = 0,
+                 concurrency: int = 1,
+                 ack_batch_size: int = 1,
+                 ack_max_delay: float = 0.) -> None:
+        super(AmqpConsumerChannel, self).__init__()
+        if prefetch_count > concurrency:
+            raise UserWarning('Consumer prefetch count %d is larger than its '
+                              'concurrency %d' % (prefetch_count,
+                                                  concurrency))
+        self.prefetch_count = prefetch_count or concurrency
+        self.concurrency = concurrency
+        self.ack_batch_size = ack_batch_size
+        self.ack_max_delay = ack_max_delay
+        self.queue = None
+        self._deliveries: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Future] = []
+        self._acks: Optional[AckCoalescer] = None
+        self._tracer_config = TracerConfig(self)
+
     async def start(self):
         await self.open()
+        await self._channel.basic_qos(prefetch_count=self.prefetch_count)
+        loop = self.amqp.loop
+        self._acks = AckCoalescer(self._ack, self.ack_batch_size,
+                                  self.ack_max_delay, loop)
+        # aioamqp runs the delivery callback in the frame reader of the
+        # connection, so it must never block: the queue holds up to
+        # prefetch_count messages, more than the broker sends unacknowledged
+        self._deliveries = asyncio.Queue(maxsize=self.prefetch_count,
+                                         loop=loop)
+        self._workers = [asyncio.ensure_future(self._worker(), loop=loop)
+                         for _ in range(self.concurrency)]
         queue = await self._safe_declare_queue('', exclusive=True)
         self.queue = queue['queue']
         await self.consume(self.msg, self.queue)
 
+    @property
+    def is_open(self) -> bool:
+        channel = getattr(self, '_channel', None)
+        return channel is not None and channel.is_open
+
+    async def stop(self):
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.cancel()
+        if workers:
+            await asyncio.wait(workers, loop=self.amqp.loop)
+        if self._acks is not None:
+            await self._acks.close()
+        await super(AmqpConsumerChannel, self).stop()
+
     async def msg(self, ctx: Span,
                   channel: AmqpChannel,
                   body: bytes,
                   envelope: AmqpEnvelope,
                   properties: AmqpProperties) -> None:
-        await self.ack(ctx, envelope.delivery_tag,
-                       tracer_config=TracerConfig(self))
+        self._acks.delivered(envelope.delivery_tag)  # type: ignore
+        self._deliveries.put_nowait((ctx, channel, body,  # type: ignore
+                                     envelope, properties))
+
+    async def _worker(self) -> None:
+        while True:
+            delivery = await self._deliveries.get()  # type: ignore
+            ctx, envelope = delivery[0], delivery[3]
+            tracing = self.amqp.app.tracing
+            span = tracing.begin(ctx)
+            timer = Timer(REGISTRY.histogram('amqp_consume_duration_seconds',
+                                             channel=self.name))
+            failed = False
+            try:
+                with timer:
+                    await self.process(span, *delivery[1:])
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                failed = True
+                self.amqp.app.log_err(err)
+            tracing.end(ctx, span, time.perf_counter() - timer.started,
+                        failed)
+            self._acks.completed(span, envelope.delivery_tag)  # type: ignore
+
+    async def _ack(self, ctx: Span, delivery_tag: int,
+                   multiple: bool) -> None:
+        await self.ack(ctx, delivery_tag, multiple=multiple,
+                       tracer_config=self._tracer_config)
+
+    async def process(self, ctx: Span,
+                      channel: AmqpChannel,
+                      body: bytes,
+                      envelope: AmqpEnvelope,
+                      properties: AmqpProperties) -> None:
         await asyncio.sleep(1, loop=self.amqp.loop)
         self.message_counter += 1
         print('MESSAGE', body)
@@ -1,7 +1,14 @@
-from typing import Optional
-from aioapp.tracer import Span
+import asyncio
+import itertools
+from typing import Dict, List, NamedTuple, Optional
+from aioapp.tracer import Span, CLIENT
 from aioapp.amqp import Channel, AmqpTracerConfig
 from aioamqp.channel import Channel as AmqpChannel
+from aioamqp.exceptions import PublishFailed
+from myaioapp.metrics import REGISTRY, Timer
+from myaioapp.tracing import is_recording
+
+STOP_TIMEOUT = 5.0
 
 
 class TracerConfig(AmqpTracerConfig):
@@ -15,17 +22,100 @@ class TracerConfig(AmqpTracerConfig):
                          exchange_name: str, routing_key: str,
                          properties: Optional[dict], mandatory: bool,
                          immediate: bool) -> None:
+        if not is_recording(ctx):
+            return
         super(TracerConfig, self).on_publish_start(ctx, channel,
                                                    payload, exchange_name,
                                                    routing_key, properties,
                                                    mandatory, immediate)
 
 
+class _Unconfirmed(NamedTuple):
+    seq: int
+    ctx: Span
+    payload: bytes
+    exchange_name: str
+    routing_key: str
+    properties: Optional[dict]
+    mandatory: bool
+    immediate: bool
+    propagate_trace: bool
+    future: asyncio.Future
+
+
+class _Buffered(NamedTuple):
+    ctx: Span
+    payload: bytes
+    exchange_name: str
+    routing_key: str
+    properties: Optional[dict]
+    mandatory: bool
+    immediate: bool
+    future: asyncio.Future
+
+
 class AmqpPublisherChannel(Channel):
     name = 'publisher'
 
+    def __init__(self, confirms: bool = False,
+                 max_in_flight: int = 100,
+                 max_redeliveries: int = 3,
+                 batch_size: int = 100,
+                 batch_max_delay: float = 0.005) -> None:
+        super(AmqpPublisherChannel, self).__init__()
+        self.confirms = confirms
+        self.max_in_flight = max_in_flight
+        self.max_redeliveries = max_redeliveries
+        self.batch_size = batch_size
+        self.batch_max_delay = batch_max_delay
+        self._buffer: List[_Buffered] = []
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._flush_timer: Optional[asyncio.Handle] = None
+        self._flushes: List[asyncio.Future] = []
+        self._seq = itertools.count()
+        self._window: Optional[asyncio.Semaphore] = None
+        self._in_flight: Dict[int, asyncio.Future] = {}
+        self._unconfirmed: Dict[int, _Unconfirmed] = {}
+        self._nacked: List[_Unconfirmed] = []
+        self._redeliveries: Dict[int, int] = {}
+
     async def start(self):
         await self.open()
+        self._flush_lock = asyncio.Lock(loop=self.amqp.loop)
+        if self.confirms:
+            await self._channel.confirm_select()
+            self._window = asyncio.Semaphore(self.max_in_flight,
+                                             loop=self.amqp.loop)
+
+    @property
+    def is_open(self) -> bool:
+        channel = getattr(self, '_channel', None)
+        return channel is not None and channel.is_open
+
+    async def stop(self):
+        """
+        Flushes the buffer and waits up to ``STOP_TIMEOUT`` seconds for the
+        unconfirmed messages, redeliveries included. The futures of the
+        messages still unconfirmed then fail with ``UserWarning``.
+        """
+        await self.flush()
+        loop = self.amqp.loop
+        stop_at = loop.time() + STOP_TIMEOUT
+        while self._in_flight and loop.time() < stop_at:
+            await asyncio.wait(list(self._in_flight.values()),
+                               timeout=stop_at - loop.time(), loop=loop)
+        self._nacked = []
+        for task in self._in_flight.values():
+            task.cancel()
+        for msg in self._unconfirmed.values():
+            if not msg.future.done():
+                msg.future.set_exception(UserWarning(
+                    'Publisher channel stopped before the message was '
+                    'confirmed'))
+        self._in_flight.clear()
+        self._unconfirmed.clear()
+        self._redeliveries.clear()
+        await super(AmqpPublisherChannel, self).stop()
 
     async def publish(self, ctx: Span, payload: bytes,
                       exchange_name: str, routing_key: str,
@@ -34,9 +124,176 @@ class AmqpPublisherChannel(Channel):
                       tracer_config: Optional[AmqpTracerConfig] = None,
                       propagate_trace: bool = True, retry: bool = True
                       ) -> None:
-        await super().publish(ctx, payload,
-                              exchange_name, routing_key,
-                              properties,
-                              mandatory, immediate,
-                              tracer_config or TracerConfig(self),
-                              propagate_trace, retry)
+        with Timer(REGISTRY.histogram('amqp_publish_duration_seconds',
+                                      channel=self.name)):
+            await super().publish(ctx, payload,
+                                  exchange_name, routing_key,
+                                  properties,
+                                  mandatory, immediate,
+                                  tracer_config or TracerConfig(self),
+                                  propagate_trace, retry)
+
+    async def publish_confirmed(self, ctx: Span, payload: bytes,
+                                exchange_name: str, routing_key: str,
+                                properties: Optional[dict] = None,
+                                mandatory: bool = False,
+                                immediate: bool = False,
+                                propagate_trace: bool = True
+                                ) -> asyncio.Future:
+        """
+        Sends the message without waiting for the broker and returns a
+        future resolved when the broker confirms it. Waits while
+        ``max_in_flight`` messages are unconfirmed. Nacked messages are
+        sent again, up to ``max_redeliveries`` times, after which the
+        future fails with ``PublishFailed``. Redeliveries keep their
+        relative order but follow the messages already sent, so a nack can
+        reorder a message after later ones.
+        """
+        if not self.confirms:
+            raise UserWarning('Publisher confirms are not enabled')
+        await self._window.acquire()  # type: ignore
+        msg = _Unconfirmed(next(self._seq), ctx, payload, exchange_name,
+                           routing_key, properties, mandatory, immediate,
+                           propagate_trace, self.amqp.loop.create_future())
+        self._unconfirmed[msg.seq] = msg
+        self._send(msg)
+        return msg.future
+
+    def _send(self, msg: _Unconfirmed) -> None:
+        self._in_flight[msg.seq] = asyncio.ensure_future(
+            self._publish_unconfirmed(msg), loop=self.amqp.loop)
+
+    async def _publish_unconfirmed(self, msg: _Unconfirmed) -> None:
+        try:
+            await self.publish(msg.ctx, msg.payload, msg.exchange_name,
+                               msg.routing_key, msg.properties,
+                               msg.mandatory, msg.immediate,
+                               propagate_trace=msg.propagate_trace)
+        except PublishFailed as err:
+            redeliveries = self._redeliveries.get(msg.seq, 0)
+            if redeliveries < self.max_redeliveries:
+                self._redeliveries[msg.seq] = redeliveries + 1
+                if not self._nacked:
+                    self.amqp.loop.call_soon(self._redeliver)
+                self._nacked.append(msg)
+                return
+            self._done(msg, err)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            self._done(msg, err)
+        else:
+            self._done(msg, None)
+
+    def _redeliver(self) -> None:
+        nacked, self._nacked = self._nacked, []
+        for msg in sorted(nacked, key=lambda msg: msg.seq):
+            self._send(msg)
+
+    def _done(self, msg: _Unconfirmed, err: Optional[Exception]) -> None:
+        self._in_flight.pop(msg.seq, None)
+        self._unconfirmed.pop(msg.seq, None)
+        self._redeliveries.pop(msg.seq, None)
+        self._window.release()  # type: ignore
+        if msg.future.done():
+            return
+        if err is None:
+            msg.future.set_result(None)
+        else:
+            msg.future.set_exception(err)
+
+    def publish_buffered(self, ctx: Span, payload: bytes,
+                         exchange_name: str, routing_key: str,
+                         properties: Optional[dict] = None,
+                         mandatory: bool = False,
+                         immediate: bool = False) -> asyncio.Future:
+        """
+        Adds the message to the publish buffer and returns a future resolved
+        when it is written. The buffer is flushed in order once it holds
+        ``batch_size`` messages or ``batch_max_delay`` seconds after the
+        first one, under a single span. Buffered messages do not carry the
+        trace context. With confirms, the future is resolved when the broker
+        confirms the message, and the batch waits for the ``max_in_flight``
+        window like ``publish_confirmed``.
+        """
+        if self._flush_lock is None:
+            raise UserWarning('Publisher channel is not started')
+        loop = self.amqp.loop
+        msg = _Buffered(ctx, payload, exchange_name, routing_key,
+                        properties, mandatory, immediate, loop.create_future())
+        self._buffer.append(msg)
+        if len(self._buffer) >= self.batch_size:
+            self._schedule_flush()
+        elif self._flush_timer is None:
+            self._flush_timer = loop.call_later(self.batch_max_delay,
+                                                self._schedule_flush)
+        return msg.future
+
+    async def flush(self) -> None:
+        if self._flush_lock is None:
+            return
+        async with self._flush_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            while self._buffer:
+                batch = self._buffer[:self.batch_size]
+                del self._buffer[:self.batch_size]
+                await self._publish_batch(batch)
+
+    async def _publish_batch(self, batch: List[_Buffered]) -> None:
+        with batch[0].ctx.new_child('amqp:publish_batch', CLIENT) as span, \
+                Timer(REGISTRY.histogram('amqp_publish_batch_duration_seconds',
+                                         channel=self.name)):
+            span.tag('amqp.batch_size', str(len(batch)))
+            REGISTRY.counter('amqp_published_total',
+                             channel=self.name).inc(len(batch))
+            if self.confirms:
+                results = await asyncio.gather(
+                    *[self._publish_windowed(msg) for msg in batch],
+                    loop=self.amqp.loop, return_exceptions=True)
+            else:
+                results = []
+                for msg in batch:
+                    try:
+                        await self._publish_raw(msg)
+                    except Exception as err:
+                        # the channel is broken, the rest would fail too
+                        results.extend([err] * (len(batch) - len(results)))
+                        break
+                    results.append(None)
+            errors = 0
+            for msg, res in zip(batch, results):
+                if msg.future.done():
+                    continue
+                if isinstance(res, BaseException):
+                    if not errors:
+                        self.amqp.app.log_err(res)
+                    errors += 1
+                    msg.future.set_exception(res)
+                else:
+                    msg.future.set_result(None)
+            if errors:
+                span.tag('amqp.batch_errors', str(errors))
+
+    async def _publish_windowed(self, msg: _Buffered) -> None:
+        await self._window.acquire()  # type: ignore
+        try:
+            await self._publish_raw(msg)
+        finally:
+            self._window.release()  # type: ignore
+
+    async def _publish_raw(self, msg: _Buffered) -> None:
+        await self._channel.publish(msg.payload, msg.exchange_name,
+                                    msg.routing_key,
+                                    properties=msg.properties,
+                                    mandatory=msg.mandatory,
+                                    immediate=msg.immediate)
+
+    def _schedule_flush(self) -> None:
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        self._flushes = [fut for fut in self._flushes if not fut.done()]
+        self._flushes.append(asyncio.ensure_future(self.flush(),
+                                                   loop=self.amqp.loop))
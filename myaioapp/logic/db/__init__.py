@@ -1,13 +1,34 @@
+from ._pg_cache import ResultCache
+from ._pg_migrations import migrate
+from ._pg_pool import PoolController, PoolLimit
+from ._pg_postgres import Postgres
+from ._pg_replica import Replica
+from ._pg_session import Session
+from ._pg_statements import StatementRegistry
 from .main import (
     GetDate,
     GetWeek,
+    InsertSomeTable,
     UpdateSomeTable,
 
 )
+from .outbox import InsertOutbox, ClaimOutbox, DeleteOutbox
 
 __all__ = [
+    'Postgres',
+    'PoolController',
+    'PoolLimit',
+    'Replica',
+    'ResultCache',
+    'Session',
+    'StatementRegistry',
+    'migrate',
     'GetDate',
     'GetWeek',
+    'InsertSomeTable',
     'UpdateSomeTable',
+    'InsertOutbox',
+    'ClaimOutbox',
+    'DeleteOutbox',
 
 ]
@@ -0,0 +1,80 @@
+import asyncio
+from collections import OrderedDict
+from functools import partial
+from typing import (Any, Awaitable, Callable, Dict, Hashable, Optional,
+                    Tuple)
+
+
+class ResultCache:
+    """
+    Read-through cache for ``Result`` queries, declared on a subclass as
+    ``__cache__ = ResultCache(ttl=..., max_entries=...)``.
+
+    Entries live for ``ttl`` seconds, the least recently used ones are
+    evicted above ``max_entries``. Concurrent misses for the same key share
+    one in-flight query. Cached rows are shared between callers and must
+    not be modified.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 1024) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[Hashable, Tuple[float, Any]]' = \
+            OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: Hashable,
+                  fetch: Callable[[], Awaitable],
+                  timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        Returns the cached value for ``key`` and whether it was a hit,
+        calling ``fetch`` on a miss. A caller waiting longer than
+        ``timeout`` for the query gets ``asyncio.TimeoutError``, the query
+        goes on for the others.
+        """
+        loop = asyncio.get_event_loop()
+        hit, value = self.lookup(key)
+        if hit:
+            return value, True
+        self.misses += 1
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(fetch(), loop=loop)
+            self._inflight[key] = fut
+            fut.add_done_callback(partial(self._store, key, loop))
+        return await asyncio.wait_for(asyncio.shield(fut, loop=loop),
+                                      timeout, loop=loop), False
+
+    def lookup(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Returns whether ``key`` has a live entry and its value, without
+        querying on a miss.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires, value = entry
+        if expires <= asyncio.get_event_loop().time():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, value
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def _store(self, key: Hashable, loop: asyncio.AbstractEventLoop,
+               fut: asyncio.Future) -> None:
+        self._inflight.pop(key, None)
+        if fut.cancelled() or fut.exception() is not None:
+            return
+        self._entries[key] = (loop.time() + self.ttl, fut.result())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
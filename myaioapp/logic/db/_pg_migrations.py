@@ -0,0 +1,61 @@
+import asyncio
+import os
+from typing import List, Optional
+import asyncpg
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), 'migrations')
+MIGRATIONS_LOCK_ID = 0x6d79616f
+
+MIGRATIONS_SQL = """\
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        name text PRIMARY KEY,
+        applied timestamptz NOT NULL DEFAULT NOW()
+    )
+"""
+
+
+def migrations(path: str = MIGRATIONS_DIR) -> List[str]:
+    """
+    Names of the ``.sql`` files of ``path`` in the order they are applied.
+    """
+    return sorted(name for name in os.listdir(path) if name.endswith('.sql'))
+
+
+async def pending_migrations(conn: asyncpg.Connection,
+                             path: str = MIGRATIONS_DIR) -> List[str]:
+    """
+    Names of the migrations of ``path`` not applied to the database yet.
+    """
+    table = await conn.fetchval("SELECT to_regclass('schema_migrations')")
+    if table is None:
+        return migrations(path)
+    done = {row['name'] for row in
+            await conn.fetch('SELECT name FROM schema_migrations')}
+    return [name for name in migrations(path) if name not in done]
+
+
+async def migrate(url: str, path: str = MIGRATIONS_DIR,
+                  loop: Optional[asyncio.AbstractEventLoop] = None
+                  ) -> List[str]:
+    """
+    Applies the migrations of ``path`` not recorded in the
+    ``schema_migrations`` table, each in its own transaction, and returns
+    their names. The advisory lock keeps concurrent deployments from
+    applying the same migration twice.
+    """
+    applied = []
+    conn = await asyncpg.connect(dsn=url, loop=loop)
+    try:
+        await conn.execute('SELECT pg_advisory_lock($1)', MIGRATIONS_LOCK_ID)
+        await conn.execute(MIGRATIONS_SQL)
+        for name in await pending_migrations(conn, path):
+            with open(os.path.join(path, name)) as f:
+                sql = f.read()
+            async with conn.transaction():
+                await conn.execute(sql)
+                await conn.execute('INSERT INTO schema_migrations (name) '
+                                   'VALUES ($1)', name)
+            applied.append(name)
+    finally:
+        await conn.close()
+    return applied
@@ -0,0 +1,205 @@
+import asyncio
+import collections
+import time
+from typing import Any, Deque, Optional, Tuple
+import asyncpg
+from aioapp.db.postgres import Connection
+from aioapp.tracer import Span
+from myaioapp.metrics import REGISTRY
+from myaioapp.tracing import is_recording
+
+SATURATION_SQL = """\
+    SELECT
+        COUNT(*)::float8 / current_setting('max_connections')::float8
+    FROM
+        pg_stat_activity
+    WHERE
+        backend_type = 'client backend'
+"""
+
+
+class PoolLimit:
+    """
+    Number of pool connections that may be in use at once. Acquisitions
+    over the limit wait in FIFO order.
+
+    The asyncpg pool is created with the upper bound of the limit and hands
+    out its most recently released connections first, so the connections
+    left over by a lower limit go idle and are closed after the pool's
+    max inactive connection lifetime.
+
+    The ``labels`` are given to its ``db_pool_*`` gauges.
+    """
+
+    def __init__(self, size: int, **labels: str) -> None:
+        self.size = size
+        self.in_use = 0
+        self._waiters: Deque[asyncio.Future] = collections.deque()
+        self._peak_in_use = 0
+        self._peak_waiting = 0
+        self._wait_sum = 0.
+        self._wait_count = 0
+        self._size_gauge = REGISTRY.gauge('db_pool_size', **labels)
+        self._in_use_gauge = REGISTRY.gauge('db_pool_in_use', **labels)
+        self._waiting_gauge = REGISTRY.gauge('db_pool_waiting', **labels)
+        self._size_gauge.set(size)
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self.in_use < self.size and not self._waiters:
+            self._take()
+            return
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        self._peak_waiting = max(self._peak_waiting, len(self._waiters))
+        self._waiting_gauge.set(len(self._waiters))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+                self._waiting_gauge.set(len(self._waiters))
+            raise
+
+    def release(self) -> None:
+        self.in_use -= 1
+        self._in_use_gauge.set(self.in_use)
+        self._wake()
+
+    def resize(self, size: int) -> None:
+        self.size = size
+        self._size_gauge.set(size)
+        self._wake()
+
+    def observe(self, wait: float) -> None:
+        self._wait_sum += wait
+        self._wait_count += 1
+
+    def window(self) -> Tuple[float, int, int]:
+        """
+        Returns the mean acquire wait and the peak numbers of connections
+        in use and of waiting acquisitions since the previous call.
+        """
+        mean_wait = self._wait_sum / self._wait_count \
+            if self._wait_count else 0.
+        window = (mean_wait, self._peak_in_use, self._peak_waiting)
+        self._wait_sum, self._wait_count = 0., 0
+        self._peak_in_use, self._peak_waiting = self.in_use, self.waiting
+        return window
+
+    def _take(self) -> None:
+        self.in_use += 1
+        self._peak_in_use = max(self._peak_in_use, self.in_use)
+        self._in_use_gauge.set(self.in_use)
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_use < self.size:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._take()
+                waiter.set_result(None)
+        self._waiting_gauge.set(len(self._waiters))
+
+
+class PoolController:
+    """
+    Resizes a ``PoolLimit`` between ``min_size`` and ``max_size``.
+
+    The limit grows by a quarter when acquisitions waited longer than
+    ``target_wait`` on average and the connections of Postgres are less
+    than ``max_saturation`` used, and shrinks by one connection when the
+    peak use stayed below it without waiting.
+    """
+
+    def __init__(self, limit: PoolLimit, min_size: int, max_size: int,
+                 target_wait: float, max_saturation: float) -> None:
+        self.limit = limit
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_wait = target_wait
+        self.max_saturation = max_saturation
+
+    def wants_growth(self, mean_wait: float, peak_waiting: int) -> bool:
+        return (peak_waiting > 0 and mean_wait > self.target_wait and
+                self.limit.size < self.max_size)
+
+    def adjust(self, mean_wait: float, peak_in_use: int, peak_waiting: int,
+               saturation: Optional[float]) -> int:
+        """
+        Applies the window of ``PoolLimit.window`` and the share of
+        ``max_connections`` in use on the server, None if unknown, and
+        returns the new size.
+        """
+        size = self.limit.size
+        if self.wants_growth(mean_wait, peak_waiting):
+            if saturation is not None and saturation < self.max_saturation:
+                size = min(self.max_size, size + max(1, size // 4))
+        elif not peak_waiting and peak_in_use < size - 1:
+            size = max(self.min_size, size - 1)
+        if size != self.limit.size:
+            REGISTRY.counter('db_pool_resizes_total',
+                             direction=('up' if size > self.limit.size
+                                        else 'down')).inc()
+            self.limit.resize(size)
+        return size
+
+
+class PoolAcquire:
+    """
+    Acquires a connection of the ``Postgres`` component within its
+    ``PoolLimit``, recording the wait in the ``db_pool_wait_seconds``
+    histogram and the ``db.pool.wait`` tag of ``ctx_span``, and counting the
+    connections the pool is going to replace after ``pool_max_queries``.
+    """
+
+    def __init__(self, db: Any, ctx_span: Span) -> None:
+        self._db = db
+        self._ctx_span = ctx_span
+        self._acquired: Any = None
+        self._conn: Optional[Connection] = None
+
+    async def __aenter__(self) -> Connection:
+        started = time.perf_counter()
+        await self._db.pool_limit.acquire(self._db.loop)
+        try:
+            self._acquired = self._db._acquire(self._ctx_span)
+            self._conn = await self._acquired.__aenter__()
+        except BaseException:
+            self._db.pool_limit.release()
+            raise
+        wait = time.perf_counter() - started
+        self._db.pool_limit.observe(wait)
+        REGISTRY.histogram('db_pool_wait_seconds').observe(wait)
+        if is_recording(self._ctx_span):
+            self._ctx_span.tag('db.pool.wait', '%.6f' % wait)
+        return self._conn  # type: ignore
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        try:
+            # asyncpg closes the connection on release once its protocol has
+            # run max_queries queries
+            protocol = getattr(self._conn._conn,  # type: ignore
+                               '_protocol', None)
+            if (protocol is not None and protocol.queries_count >=
+                    self._db._pool_max_queries):
+                REGISTRY.counter('db_pool_recycled_total').inc()
+            await self._acquired.__aexit__(exc_type, exc_val, exc_tb)
+        finally:
+            self._db.pool_limit.release()
+
+
+def idle_connections(pool: asyncpg.pool.Pool) -> int:
+    """
+    Number of open connections of ``pool`` not in use.
+    """
+    get_idle_size = getattr(pool, 'get_idle_size', None)
+    if get_idle_size is not None:
+        return get_idle_size()
+    # asyncpg before 0.25
+    return sum(1 for holder in pool._holders
+               if holder._con is not None and holder._in_use is None)
@@ -0,0 +1,229 @@
+import asyncio
+from typing import Any, List, Optional, Sequence, Set, Type
+import asyncpg
+import aioapp.db
+from aioapp.tracer import Span
+from myaioapp.logic.fanout import fanout
+from myaioapp.metrics import REGISTRY
+from ._pg_migrations import pending_migrations
+from ._pg_pool import (PoolAcquire, PoolController, PoolLimit,
+                       SATURATION_SQL, idle_connections)
+from ._pg_replica import Replica
+from ._pg_result import Result
+from ._pg_session import Session
+from ._pg_statements import StatementRegistry
+
+
+class Postgres(aioapp.db.Postgres):
+    """
+    ``aioapp.db.Postgres`` whose pool connections get the statements of the
+    registry prepared when they are opened.
+
+    Connections are acquired within a ``PoolLimit``. With ``pool_adaptive``
+    it starts at ``pool_min_size`` and a ``PoolController`` resizes it up to
+    ``pool_max_size`` every ``pool_adjust_interval`` seconds, otherwise it
+    stays at ``pool_max_size``. The pool gauges are refreshed at the same
+    interval.
+
+    Reads of ``Result`` classes marked ``__readonly__`` go to the least busy
+    of the ``replica_urls`` replicas, each with a pool of the same size
+    within a fixed limit, so a worker of a multi-process setup gets the
+    same share of every server.
+    Their replication lag is checked every ``replica_check_interval``
+    seconds, and a replica failing or lagging more than
+    ``replica_max_lag`` seconds is skipped until the next check.
+
+    The component refuses to start while a migration is not applied, see
+    ``myaioapp.cli --migrate``.
+    """
+
+    def __init__(self, url: str,
+                 pool_min_size: int = 10,
+                 pool_max_size: int = 10,
+                 pool_max_queries: int = 50000,
+                 pool_max_inactive_connection_lifetime: float = 300.0,
+                 connect_max_attempts: int = 10,
+                 connect_retry_delay: float = 1.0,
+                 statements: Optional[StatementRegistry] = None,
+                 replica_urls: Sequence[str] = (),
+                 replica_max_lag: float = 10.,
+                 replica_check_interval: float = 5.,
+                 pool_adaptive: bool = False,
+                 pool_adjust_interval: float = 5.,
+                 pool_target_wait: float = .005,
+                 pool_max_saturation: float = .9) -> None:
+        super(Postgres, self).__init__(
+            url=url,
+            pool_min_size=pool_min_size,
+            pool_max_size=pool_max_size,
+            pool_max_queries=pool_max_queries,
+            pool_max_inactive_connection_lifetime=(
+                pool_max_inactive_connection_lifetime),
+            connect_max_attempts=connect_max_attempts,
+            connect_retry_delay=connect_retry_delay
+        )
+        self._url = url
+        self._pool_min_size = pool_min_size
+        self._pool_max_size = pool_max_size
+        self._pool_max_queries = pool_max_queries
+        self._pool_max_inactive = pool_max_inactive_connection_lifetime
+        self.statements = statements or StatementRegistry()
+        self.replicas = [Replica(url, replica_max_lag,
+                                 replica_check_interval, pool_max_size,
+                                 name=str(i))
+                         for i, url in enumerate(replica_urls)]
+        self.replica_check_interval = replica_check_interval
+        self._replica_task: Optional[asyncio.Future] = None
+        self.pool_limit = PoolLimit(pool_min_size if pool_adaptive
+                                    else pool_max_size)
+        self.pool_controller: Optional[PoolController] = None
+        if pool_adaptive:
+            self.pool_controller = PoolController(
+                self.pool_limit, pool_min_size, pool_max_size,
+                pool_target_wait, pool_max_saturation)
+        self.pool_adjust_interval = pool_adjust_interval
+        self._pool_task: Optional[asyncio.Future] = None
+        self._failed_statements: Set[Type[Result]] = set()
+
+    async def _connect(self) -> None:
+        self._pool = await self._create_pool(self._url)
+        await fanout(*[self._connect_replica(replica)
+                       for replica in self.replicas], loop=self.loop)
+
+    async def start(self) -> None:
+        await super(Postgres, self).start()
+        async with self._pool.acquire() as conn:  # type: ignore
+            pending = await pending_migrations(conn)
+        if pending:
+            raise UserWarning('Database migrations %s are not applied, run '
+                              'python -m myaioapp.cli --migrate'
+                              % ', '.join(pending))
+        self._pool_task = asyncio.ensure_future(self._watch_pool(),
+                                                loop=self.loop)
+        if self.replicas:
+            self._replica_task = asyncio.ensure_future(
+                self._check_replicas(), loop=self.loop)
+
+    async def stop(self) -> None:
+        for task in (self._pool_task, self._replica_task):
+            if task is not None:
+                task.cancel()
+                await asyncio.wait([task], loop=self.loop)
+        self._pool_task = self._replica_task = None
+        for replica in self.replicas:
+            if replica.pool is not None:
+                await replica.pool.close()
+                replica.pool = None
+        await super(Postgres, self).stop()
+
+    def connection(self, ctx: Span) -> PoolAcquire:  # type: ignore
+        return PoolAcquire(self, ctx)
+
+    def _acquire(self, ctx: Span) -> Any:
+        return super(Postgres, self).connection(ctx)
+
+    def replica(self) -> Optional[Replica]:
+        """
+        Returns the available replica with the fewest queries in progress.
+        """
+        available: List[Replica] = [replica for replica in self.replicas
+                                    if replica.available]
+        if not available:
+            return None
+        return min(available, key=lambda replica: replica.outstanding)
+
+    async def _create_pool(self, url: str) -> asyncpg.pool.Pool:
+        return await asyncpg.create_pool(
+            dsn=url,
+            min_size=self._pool_min_size,
+            max_size=self._pool_max_size,
+            max_queries=self._pool_max_queries,
+            max_inactive_connection_lifetime=self._pool_max_inactive,
+            init=self._init_connection,
+            loop=self.loop
+        )
+
+    async def _connect_replica(self, replica: Replica) -> None:
+        try:
+            replica.pool = await self._create_pool(replica.url)
+        except Exception as err:
+            replica.fail()
+            self.app.log_err(err)
+
+    async def _watch_pool(self) -> None:
+        idle = REGISTRY.gauge('db_pool_idle')
+        while True:
+            await asyncio.sleep(self.pool_adjust_interval, loop=self.loop)
+            if self._pool is not None:
+                idle.set(idle_connections(self._pool))
+            for replica in self.replicas:
+                if replica.pool is not None:
+                    REGISTRY.gauge('db_pool_idle', replica=replica.name).set(
+                        idle_connections(replica.pool))
+            if self.pool_controller is None:
+                continue
+            window = self.pool_limit.window()
+            saturation = None
+            if self.pool_controller.wants_growth(window[0], window[2]):
+                saturation = await self._saturation()
+            self.pool_controller.adjust(*window, saturation)
+
+    async def _saturation(self) -> Optional[float]:
+        """
+        Returns the share of the server's ``max_connections`` in use, or
+        None if it cannot be queried in time.
+        """
+        timeout = self.pool_adjust_interval
+        try:
+            async with self._pool.acquire(timeout=timeout) as conn:
+                return float(await conn.fetchval(SATURATION_SQL,
+                                                 timeout=timeout))
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            self.app.log_err(err)
+            return None
+
+    async def _check_replicas(self) -> None:
+        while True:
+            await asyncio.sleep(self.replica_check_interval, loop=self.loop)
+            for replica in self.replicas:
+                if replica.pool is None:
+                    await self._connect_replica(replica)
+                    continue
+                try:
+                    await replica.check(self.replica_check_interval)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    replica.fail()
+
+    def session(self, ctx: Span) -> Session:
+        """
+        ``async with db.session(ctx) as session`` runs the ``Result`` calls
+        given ``session`` on one pool connection.
+        """
+        return Session(ctx, self)
+
+    def transaction(self, ctx: Span) -> Session:
+        """
+        Same as ``session`` with the calls in one transaction.
+        """
+        return Session(ctx, self, transaction=True)
+
+    async def ping(self, timeout: Optional[float] = None) -> None:
+        """
+        Checks that a connection can be acquired from the pool and answers
+        a trivial query. Not traced.
+        """
+        if self._pool is None:
+            raise UserWarning('Postgres pool is not connected')
+        async with self._pool.acquire(timeout=timeout) as conn:
+            await conn.fetchval('SELECT 1', timeout=timeout)
+
+    async def _init_connection(self, conn: asyncpg.Connection) -> None:
+        errors = await self.statements.prepare(conn)
+        for cls, err in errors.items():
+            if cls not in self._failed_statements:
+                self._failed_statements.add(cls)
+                self.app.log_err(err)
@@ -0,0 +1,89 @@
+import time
+import asyncio
+from typing import Any, Optional
+import asyncpg
+from myaioapp.metrics import REGISTRY
+from ._pg_pool import PoolLimit
+
+LAG_SQL = """\
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM
+                              NOW() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+# errors after which a read is retried on the primary, including the
+# queries a hot standby cancels on a conflict with recovery
+REPLICA_ERRORS = (OSError, asyncio.TimeoutError,
+                  asyncpg.PostgresConnectionError, asyncpg.InterfaceError,
+                  asyncpg.QueryCanceledError, asyncpg.SerializationError)
+
+
+class _ReplicaAcquire:
+
+    def __init__(self, replica: 'Replica') -> None:
+        self._replica = replica
+        self._acquired: Any = None
+
+    async def __aenter__(self) -> asyncpg.Connection:
+        self._replica.outstanding += 1
+        try:
+            await self._replica.limit.acquire(asyncio.get_event_loop())
+            try:
+                self._acquired = self._replica.pool.acquire()  # type: ignore
+                return await self._acquired.__aenter__()
+            except BaseException:
+                self._replica.limit.release()
+                raise
+        except BaseException:
+            self._replica.outstanding -= 1
+            raise
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        try:
+            await self._acquired.__aexit__(exc_type, exc_val, exc_tb)
+        finally:
+            self._replica.limit.release()
+            self._replica.outstanding -= 1
+
+
+class Replica:
+    """
+    Read replica with its own pool. It takes reads while it is connected,
+    its replication lag is at most ``max_lag`` seconds and it has not
+    failed in the last ``retry_delay`` seconds.
+
+    Its connections are acquired within a fixed ``PoolLimit`` of
+    ``pool_size``, whose gauges are labelled with ``replica=name``. Unlike
+    the limit of the primary it is not resized.
+    """
+
+    def __init__(self, url: str, max_lag: float, retry_delay: float,
+                 pool_size: int = 10, name: str = '0') -> None:
+        self.url = url
+        self.name = name
+        self.limit = PoolLimit(pool_size, replica=name)
+        self.max_lag = max_lag
+        self.retry_delay = retry_delay
+        self.pool: Optional[asyncpg.pool.Pool] = None
+        self.outstanding = 0
+        self.lag = 0.
+        self._down_until = 0.
+
+    @property
+    def available(self) -> bool:
+        return (self.pool is not None and self.lag <= self.max_lag and
+                time.monotonic() >= self._down_until)
+
+    def acquire(self) -> _ReplicaAcquire:
+        return _ReplicaAcquire(self)
+
+    def fail(self) -> None:
+        self._down_until = time.monotonic() + self.retry_delay
+        REGISTRY.counter('db_replica_failures_total').inc()
+
+    async def check(self, timeout: float) -> None:
+        async with self.pool.acquire(timeout=timeout) as conn:  # type: ignore
+            self.lag = float(await conn.fetchval(LAG_SQL, timeout=timeout))
+        self._down_until = 0.
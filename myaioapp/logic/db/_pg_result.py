@@ -1,55 +1,428 @@
-from typing import Any, Type, Union, Tuple, Optional
+import asyncio
+from contextlib import contextmanager
+from functools import partial
+from typing import (Any, AsyncGenerator, Awaitable, Callable, Dict,
+                    Iterable, Iterator, List, Type, TypeVar, Union, Tuple,
+                    Optional)
+import asyncpg
 import asyncpg.protocol
-from aioapp.tracer import Span
+from aioapp.tracer import Span, CLIENT
 from aioapp.db.postgres import Postgres, Connection, PostgresTracerConfig
+from myaioapp.metrics import REGISTRY, Timer
+from myaioapp.logic.deadline import (Budget, DeadlineExceeded, budget,
+                                     remaining)
+from myaioapp.tracing import is_recording
+from ._pg_cache import ResultCache
+from ._pg_replica import Replica, REPLICA_ERRORS
+from ._pg_session import Session
 
-DbType = Union[Connection, Postgres]
+DbType = Union[Connection, Postgres, Session, Replica]
+R = TypeVar('R', bound='Result')
+
+STREAM_PREFETCH = 1000
 
 
 class TracerConfig(PostgresTracerConfig):
 
     def on_query_start(self, ctx_span: 'Span', id: str, query: str,
                        args: tuple, timeout: Optional[float]):
+        if not is_recording(ctx_span):
+            return
         super(TracerConfig, self).on_query_start(ctx_span, id, query,
                                                  args, timeout)
 
+    def on_query_end(self, ctx_span: 'Span', err: Optional[BaseException],
+                     result: Any):
+        if not is_recording(ctx_span):
+            return
+        super(TracerConfig, self).on_query_end(ctx_span, err, result)
+
+
+class _RawConnection:
+    """
+    Yields the asyncpg connection behind ``db``, acquiring one from the pool
+    for the duration of the block if ``db`` is the ``Postgres`` component
+    or a ``Replica``.
+    Waits at most ``timeout`` seconds for the connection.
+    """
+
+    def __init__(self, ctx_span: Span, db: DbType,
+                 timeout: Optional[float] = None) -> None:
+        self._ctx_span = ctx_span
+        self._db = db
+        self._timeout = timeout
+        self._acquired: Any = None
+
+    async def __aenter__(self) -> asyncpg.Connection:
+        if self._timeout is None:
+            return await self._enter()
+        return await asyncio.wait_for(self._enter(), self._timeout)
+
+    async def _enter(self) -> asyncpg.Connection:
+        if isinstance(self._db, Connection):
+            return self._db._conn
+        if isinstance(self._db, Session):
+            if self._db.conn is None:
+                raise UserWarning('Session is not open')
+            return self._db.conn._conn
+        if isinstance(self._db, Replica):
+            self._acquired = self._db.acquire()
+            return await self._acquired.__aenter__()
+        self._acquired = self._db.connection(self._ctx_span)
+        conn = await self._acquired.__aenter__()
+        return conn._conn
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        if self._acquired is not None:
+            await self._acquired.__aexit__(exc_type, exc_val, exc_tb)
+            self._acquired = None
+
+
+class ResultMeta(type):
+    """
+    Turns the public annotations of a Result subclass into ``__slots__``
+    and stores their names in ``__fields__``, so rows carry no instance
+    ``__dict__``. Fields must be annotated without a default value.
+    ``__columns__`` require a ``__table__`` to copy records to.
+    """
+    __fields__: Tuple[str, ...]
+
+    def __new__(mcs, name: str, bases: tuple, namespace: dict):
+        inherited: Tuple[str, ...] = ()
+        for base in bases:
+            for field in getattr(base, '__fields__', ()):
+                if field not in inherited:
+                    inherited += (field,)
+        own = tuple(key for key in namespace.get('__annotations__', {})
+                    if not key.startswith('_') and key not in inherited)
+        namespace['__slots__'] = own
+        cls = super(ResultMeta, mcs).__new__(mcs, name, bases, namespace)
+        cls.__fields__ = inherited + own
+        if cls.__columns__ and cls.__table__ is None:  # type: ignore
+            raise TypeError('%s has __columns__ but no __table__' % name)
+        return cls
+
 
-class Result:
+class Result(metaclass=ResultMeta):
     __sql__: str
+    __fields__: Tuple[str, ...]
+    __cache__: Optional[ResultCache] = None
+    __readonly__: bool = False
+    __timeout__: Optional[float] = None
+    __table__: Optional[str] = None
+    __columns__: Tuple[str, ...] = ()
 
     def __init__(self, **kwargs) -> None:
-        self._vals = kwargs
         for key, value in kwargs.items():
             setattr(self, key, self._format(key, value))
 
-    def asdict(self):
-        return self._vals
+    def asdict(self) -> Dict[str, Any]:
+        return {key: getattr(self, key) for key in self.__fields__}
 
     def _format(self, key: str, val: Any) -> Any:
         return val
 
+    @classmethod
+    def _positions(cls, record: asyncpg.protocol.Record) -> Tuple[int, ...]:
+        keys = list(record.keys())
+        positions = []
+        for field in cls.__fields__:
+            if field not in keys:
+                raise KeyError('Column %r of %s is missing in the query '
+                               'result' % (field, cls.__name__))
+            positions.append(keys.index(field))
+        return tuple(positions)
+
+    @classmethod
+    def _from_record(cls: Type[R], record: asyncpg.protocol.Record,
+                     positions: Tuple[int, ...]) -> R:
+        row = cls.__new__(cls)
+        if cls._format is Result._format:
+            for key, pos in zip(cls.__fields__, positions):
+                setattr(row, key, record[pos])
+        else:
+            for key, pos in zip(cls.__fields__, positions):
+                setattr(row, key, row._format(key, record[pos]))
+        return row
+
+    @classmethod
+    def _from_records(cls: Type[R], records: List[asyncpg.protocol.Record]
+                      ) -> List[R]:
+        if not records:
+            return []
+        positions = cls._positions(records[0])
+        return [cls._from_record(record, positions) for record in records]
+
+    @classmethod
+    def _timer(cls) -> Timer:
+        return Timer(REGISTRY.histogram('db_query_duration_seconds',
+                                        query=cls.__name__))
+
+    @classmethod
+    @contextmanager
+    def _query_span(cls, ctx_span: Span, params: Tuple,
+                    timeout: Optional[float] = None) -> Iterator[Span]:
+        """
+        Opens the query span and times the block, running the start and end
+        hooks of ``TracerConfig`` as ``aioapp.db.Connection`` queries do.
+        """
+        tracer_config = TracerConfig()
+        with ctx_span.new_child('db:%s' % cls.__name__, CLIENT) as span, \
+                cls._timer():
+            tracer_config.on_query_start(span, cls.__name__, cls.__sql__,
+                                         params, timeout)
+            try:
+                yield span
+            except BaseException as err:
+                tracer_config.on_query_end(span, err, None)
+                raise
+            tracer_config.on_query_end(span, None, None)
+
     @staticmethod
     async def _execute(cls: Type['Result'], ctx_span: Span,
                        db: DbType,
                        params: Tuple) -> str:
-        return await db.execute(ctx_span, cls.__name__, cls.__sql__,
-                                *params,
-                                tracer_config=TracerConfig())
+        call = Budget(cls.__timeout__)
+        async with _RawConnection(ctx_span, db, call.left()) as conn:
+            timeout = call.left()
+            with cls._query_span(ctx_span, params, timeout):
+                return await conn.execute(cls.__sql__, *params,
+                                          timeout=timeout)
+
+    @staticmethod
+    async def _execute_many(cls: Type['Result'], ctx_span: Span,
+                            db: DbType,
+                            params: Iterable[Tuple]) -> int:
+        """
+        Executes the statement once per params tuple in a single round trip
+        and a single span. Returns the number of executed tuples.
+        """
+        args = list(params)
+        if not args:
+            return 0
+        call = Budget(cls.__timeout__)
+        async with _RawConnection(ctx_span, db, call.left()) as conn:
+            timeout = call.left()
+            with cls._query_span(ctx_span, (), timeout) as span:
+                span.tag('db.rows', str(len(args)))
+                await conn.executemany(cls.__sql__, args, timeout=timeout)
+        return len(args)
+
+    @staticmethod
+    async def _copy_many(cls: Type['Result'], ctx_span: Span,
+                         db: DbType,
+                         records: Iterable[Tuple]) -> int:
+        """
+        Bulk inserts records into ``__table__`` with COPY, ``__columns__``
+        giving the column of each tuple item. Returns the number of
+        inserted records.
+        """
+        if cls.__table__ is None:
+            raise TypeError('%s has no __table__ to copy records to'
+                            '' % cls.__name__)
+        rows = list(records)
+        if not rows:
+            return 0
+        call = Budget(cls.__timeout__)
+        async with _RawConnection(ctx_span, db, call.left()) as conn:
+            timeout = call.left()
+            with cls._query_span(ctx_span, (), timeout) as span:
+                span.tag('db.rows', str(len(rows)))
+                await conn.copy_records_to_table(
+                    cls.__table__, records=rows,
+                    columns=list(cls.__columns__) or None, timeout=timeout)
+        return len(rows)
 
     @staticmethod
-    async def _query_one(cls: Type['Result'], ctx_span: Span,
+    async def _cached(cls: Type['Result'], ctx_span: Span, db: DbType,
+                      params: Tuple,
+                      fetch: Callable[[Span], Awaitable[Any]]) -> Any:
+        """
+        Serves the query from ``__cache__`` when ``db`` is the pool. Reads
+        on a session or a connection bypass it: they must see the writes of
+        their transaction, and a shared fetch must not run on the
+        connection of another caller.
+        """
+        cache = cls.__cache__
+        if cache is None or not isinstance(db, (Postgres, Replica)):
+            return await fetch(ctx_span)
+        with ctx_span.new_child('db:cache:%s' % cls.__name__,
+                                CLIENT) as span:
+            span.metrics_tag('db.cache', cls.__name__)
+            hit, res = cache.lookup((cls, params))
+            if not hit:
+                res, hit = await cache.get((cls, params),
+                                           partial(fetch, span),
+                                           timeout=budget(None))
+            span.metrics_tag('db.cache.result', 'hit' if hit else 'miss')
+        REGISTRY.counter('db_cache_total', query=cls.__name__,
+                         result='hit' if hit else 'miss').inc()
+        return res
+
+    @staticmethod
+    async def _query_one(cls: Type[R], ctx_span: Span,
                          db: DbType,
-                         params: Tuple) -> asyncpg.protocol.Record:
-        res = await db.query_one(ctx_span, cls.__name__, cls.__sql__,
-                                 *params,
-                                 tracer_config=TracerConfig())
-        return cls(**dict(res)) if res is not None else None
+                         params: Tuple) -> Optional[R]:
+        async def fetch(span: Span) -> Optional[R]:
+            return await Result._routed(cls, span, db, params,
+                                        Result._fetch_one)
+
+        return await Result._cached(cls, ctx_span, db, params, fetch)
 
     @staticmethod
-    async def _query_all(cls: Type['Result'], ctx_span: Span,
+    async def _query_all(cls: Type[R], ctx_span: Span,
                          db: DbType,
-                         params: Tuple) -> asyncpg.protocol.Record:
-        res = await db.query_all(ctx_span, cls.__name__, cls.__sql__,
-                                 *params,
-                                 tracer_config=TracerConfig())
-        return [cls(**dict(row)) for row in res] if res is not None else None
+                         params: Tuple) -> List[R]:
+        async def fetch(span: Span) -> List[R]:
+            return await Result._routed(cls, span, db, params,
+                                        Result._fetch_all)
+
+        return await Result._cached(cls, ctx_span, db, params, fetch)
+
+    @staticmethod
+    def _replica(cls: Type['Result'], db: DbType) -> Optional[Replica]:
+        if not cls.__readonly__ or not hasattr(db, 'replica'):
+            return None
+        return db.replica()  # type: ignore
+
+    @staticmethod
+    async def _routed(cls: Type['Result'], ctx_span: Span,
+                      db: DbType, params: Tuple,
+                      fetch: Callable[..., Awaitable[Any]]) -> Any:
+        """
+        Runs a read-only query on the least busy available replica of the
+        ``Postgres`` component, falling back to the primary if the replica
+        fails. A timeout caused by the deadline of the request is not held
+        against the replica.
+        """
+        replica = Result._replica(cls, db)
+        if replica is not None:
+            try:
+                return await fetch(cls, ctx_span, replica, params)
+            except DeadlineExceeded:
+                raise
+            except REPLICA_ERRORS:
+                if not Result._fall_back(replica):
+                    raise
+        return await fetch(cls, ctx_span, db, params)
+
+    @staticmethod
+    def _fall_back(replica: Replica) -> bool:
+        """
+        Tells whether a read that failed on ``replica`` can be retried on
+        the primary, and if so, takes the replica out of rotation.
+        """
+        left = remaining()
+        if left is not None and left <= 0:
+            return False
+        replica.fail()
+        return True
+
+    @staticmethod
+    async def _fetch_one(cls: Type[R], ctx_span: Span,
+                         db: DbType,
+                         params: Tuple) -> Optional[R]:
+        call = Budget(cls.__timeout__)
+        async with _RawConnection(ctx_span, db, call.left()) as conn:
+            timeout = call.left()
+            with cls._query_span(ctx_span, params, timeout):
+                res = await conn.fetchrow(cls.__sql__, *params,
+                                          timeout=timeout)
+        if res is None:
+            return None
+        return cls._from_record(res, cls._positions(res))
+
+    @staticmethod
+    async def _fetch_all(cls: Type[R], ctx_span: Span,
+                         db: DbType,
+                         params: Tuple) -> List[R]:
+        call = Budget(cls.__timeout__)
+        async with _RawConnection(ctx_span, db, call.left()) as conn:
+            timeout = call.left()
+            with cls._query_span(ctx_span, params, timeout):
+                res = await conn.fetch(cls.__sql__, *params, timeout=timeout)
+        return cls._from_records(res)
+
+    @staticmethod
+    async def _stream(cls: Type['Result'], ctx_span: Span,
+                      db: DbType, params: Tuple,
+                      prefetch: int = STREAM_PREFETCH,
+                      batch_size: Optional[int] = None
+                      ) -> AsyncGenerator[Any, None]:
+        """
+        Iterates over the query result through a server-side cursor, so at
+        most ``prefetch`` (or ``batch_size``) records are held in memory.
+        Yields rows one by one, or lists of ``batch_size`` rows if given.
+        The connection and the query span are held until the iteration is
+        over. ``__timeout__`` and the deadline bound each fetch of the cursor
+        but not the whole iteration.
+
+        Read-only queries run on a replica like ``_routed`` ones, and fall
+        back to the primary if the replica fails before the first row.
+        """
+        replica = Result._replica(cls, db)
+        if replica is not None:
+            started = False
+            items = Result._stream_on(cls, ctx_span, replica, params,
+                                      prefetch, batch_size)
+            try:
+                async for item in items:
+                    started = True
+                    yield item
+                return
+            except DeadlineExceeded:
+                raise
+            except REPLICA_ERRORS:
+                if started or not Result._fall_back(replica):
+                    raise
+            finally:
+                await items.aclose()
+        items = Result._stream_on(cls, ctx_span, db, params, prefetch,
+                                  batch_size)
+        try:
+            async for item in items:
+                yield item
+        finally:
+            await items.aclose()
+
+    @staticmethod
+    async def _stream_on(cls: Type['Result'], ctx_span: Span,
+                         db: DbType, params: Tuple, prefetch: int,
+                         batch_size: Optional[int]
+                         ) -> AsyncGenerator[Any, None]:
+        call = Budget(cls.__timeout__)
+        with cls._query_span(ctx_span, params, call.left()) as span:
+            rows = 0
+            async with _RawConnection(span, db, call.left()) as conn:
+                timeout = call.left()
+                factory = conn.cursor(cls.__sql__, *params,
+                                      prefetch=prefetch, timeout=timeout)
+                xact = None
+                if not conn.is_in_transaction():
+                    xact = conn.transaction()
+                    await xact.start()
+                try:
+                    if batch_size is None:
+                        positions = None
+                        async for record in factory:
+                            if positions is None:
+                                positions = cls._positions(record)
+                            rows += 1
+                            yield cls._from_record(record, positions)
+                    else:
+                        cursor = await factory
+                        while True:
+                            records = await cursor.fetch(batch_size)
+                            if not records:
+                                break
+                            rows += len(records)
+                            yield cls._from_records(records)
+                except BaseException:
+                    if xact is not None:
+                        await xact.rollback()
+                    raise
+                else:
+                    if xact is not None:
+                        await xact.commit()
+                finally:
+                    span.tag('db.rows', str(rows))
@@ -0,0 +1,81 @@
+import asyncio
+from typing import Any, Optional
+import aioapp.db
+from aioapp.db.postgres import Connection
+from aioapp.tracer import Span, CLIENT
+from myaioapp.logic.deadline import DeadlineExceeded, budget
+
+
+class Session:
+    """
+    Pool connection held for a chain of ``Result`` calls, optionally inside
+    a transaction that is committed on success and rolled back on error.
+    Pass the session as ``db`` to the ``Result`` methods.
+
+    The connection is acquired in a ``db:acquire`` span, tagged with the
+    time spent waiting for the pool. Acquiring the connection with BEGIN,
+    and COMMIT, are bounded by the deadline of the task.
+
+    asyncpg runs one operation at a time per connection, so the calls on a
+    session must be awaited one after the other. Independent reads belong
+    outside of it, on the ``Postgres`` component, where ``fanout`` runs
+    them in parallel.
+    """
+
+    def __init__(self, ctx_span: Span, db: aioapp.db.Postgres,
+                 transaction: bool = False) -> None:
+        self._ctx_span = ctx_span
+        self._db = db
+        self.transaction = transaction
+        self.conn: Optional[Connection] = None
+        self._span: Any = None
+        self._acquired: Any = None
+        self._xact: Any = None
+
+    async def __aenter__(self) -> 'Session':
+        self._span = self._ctx_span.new_child(
+            'db:transaction' if self.transaction else 'db:session', CLIENT)
+        self._span.__enter__()
+        try:
+            await asyncio.wait_for(self._open(), budget(None),
+                                   loop=self._db.loop)
+        except BaseException as err:
+            await self._release(type(err), err, err.__traceback__)
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        try:
+            if self._xact is not None:
+                if exc_type is None:
+                    await self._commit()
+                else:
+                    await self._xact.rollback()
+        finally:
+            await self._release(exc_type, exc_val, exc_tb)
+
+    async def _open(self) -> None:
+        with self._span.new_child('db:acquire', CLIENT) as span:
+            acquired = self._db.connection(span)
+            self.conn = await acquired.__aenter__()
+            self._acquired = acquired
+        if self.transaction:
+            self._xact = self.conn._conn.transaction()  # type: ignore
+            await self._xact.start()
+
+    async def _commit(self) -> None:
+        try:
+            timeout = budget(None)
+        except DeadlineExceeded:
+            await self._xact.rollback()
+            raise
+        await asyncio.wait_for(self._xact.commit(), timeout,
+                               loop=self._db.loop)
+
+    async def _release(self, exc_type, exc_val, exc_tb) -> None:
+        try:
+            if self._acquired is not None:
+                await self._acquired.__aexit__(exc_type, exc_val, exc_tb)
+        finally:
+            self._acquired = self.conn = self._xact = None
+            self._span.__exit__(exc_type, exc_val, exc_tb)
@@ -0,0 +1,40 @@
+from types import ModuleType
+from typing import Dict, List, Type
+import asyncpg
+from ._pg_result import Result
+
+Errors = Dict[Type[Result], Exception]
+
+
+class StatementRegistry:
+    """
+    Collection of the ``Result`` subclasses whose ``__sql__`` is prepared on
+    every new pool connection.
+
+    ``Connection.prepare`` bypasses the statement cache of the asyncpg
+    connection, so the statements are parsed through ``_get_statement``,
+    the cached path that ``fetch`` and ``execute`` take: the first query of
+    a ``Result`` on a new connection then finds its statement parsed and
+    described. Nothing is executed, so writes are safe to register.
+    """
+
+    def __init__(self, *modules: ModuleType) -> None:
+        self.classes: List[Type[Result]] = []
+        for module in modules:
+            self.discover(module)
+
+    def discover(self, module: ModuleType) -> None:
+        for obj in vars(module).values():
+            if (isinstance(obj, type) and issubclass(obj, Result) and
+                    getattr(obj, '__sql__', None) and
+                    obj not in self.classes):
+                self.classes.append(obj)
+
+    async def prepare(self, conn: asyncpg.Connection) -> Errors:
+        errors: Errors = {}
+        for cls in self.classes:
+            try:
+                await conn._get_statement(cls.__sql__, None)
+            except asyncpg.PostgresError as err:
+                errors[cls] = err
+        return errors
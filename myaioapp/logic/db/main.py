@@ -1,16 +1,20 @@
-from typing import List
+from typing import AsyncGenerator, Iterable, List, Optional, Tuple
 from datetime import datetime
 from aioapp.tracer import Span
-from ._pg_result import Result, DbType
+from ._pg_cache import ResultCache
+from ._pg_result import Result, DbType, STREAM_PREFETCH
 
 
 class GetDate(Result):
     now: datetime
 
     __sql__ = 'SELECT NOW() as now'
+    __cache__ = ResultCache(ttl=1.0, max_entries=1)
+    __readonly__ = True
+    __timeout__ = 1.0
 
     @classmethod
-    async def exec(cls, ctx: Span, db: DbType) -> 'GetDate':
+    async def exec(cls, ctx: Span, db: DbType) -> Optional['GetDate']:
         params = ()
         return await Result._query_one(cls, ctx, db, params)
 
@@ -28,12 +32,22 @@ class GetWeek(Result):
                 '1day'::interval
             ) as date
     """
+    __cache__ = ResultCache(ttl=1.0, max_entries=1)
+    __readonly__ = True
+    __timeout__ = 2.0
 
     @classmethod
     async def exec(cls, ctx: Span, db: DbType) -> List['GetWeek']:
         params = ()
         return await Result._query_all(cls, ctx, db, params)
 
+    @classmethod
+    def exec_iter(cls, ctx: Span, db: DbType,
+                  prefetch: int = STREAM_PREFETCH
+                  ) -> AsyncGenerator['GetWeek', None]:
+        params = ()
+        return Result._stream(cls, ctx, db, params, prefetch=prefetch)
+
 
 class UpdateSomeTable(Result):
     __sql__ = """\
@@ -49,3 +63,31 @@ class UpdateSomeTable(Result):
     async def exec(cls, ctx: Span, db: DbType, id: int) -> None:
         params = (id,)
         await Result._execute(cls, ctx, db, params)
+
+    @classmethod
+    async def exec_many(cls, ctx: Span, db: DbType,
+                        ids: Iterable[int]) -> int:
+        params = [(id,) for id in ids]
+        return await Result._execute_many(cls, ctx, db, params)
+
+
+class InsertSomeTable(Result):
+    __sql__ = """\
+        INSERT INTO
+            some_table (id, some_field)
+        VALUES
+            ($1, $2)
+    """
+    __table__ = 'some_table'
+    __columns__ = ('id', 'some_field')
+
+    @classmethod
+    async def exec(cls, ctx: Span, db: DbType, id: int,
+                   some_field: int) -> None:
+        params = (id, some_field)
+        await Result._execute(cls, ctx, db, params)
+
+    @classmethod
+    async def exec_many(cls, ctx: Span, db: DbType,
+                        rows: Iterable[Tuple[int, int]]) -> int:
+        return await Result._copy_many(cls, ctx, db, rows)
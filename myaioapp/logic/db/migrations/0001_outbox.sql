@@ -0,0 +1,8 @@
+CREATE TABLE outbox (
+    id bigserial PRIMARY KEY,
+    exchange_name text NOT NULL,
+    routing_key text NOT NULL,
+    payload bytea NOT NULL,
+    created timestamptz NOT NULL DEFAULT NOW(),
+    claimed_until timestamptz
+);
@@ -0,0 +1,73 @@
+from typing import Iterable, List
+from aioapp.tracer import Span
+from ._pg_result import Result, DbType
+
+
+class InsertOutbox(Result):
+    __sql__ = """\
+        INSERT INTO
+            outbox (exchange_name, routing_key, payload)
+        VALUES
+            ($1, $2, $3)
+    """
+
+    @classmethod
+    async def exec(cls, ctx: Span, db: DbType, exchange_name: str,
+                   routing_key: str, payload: bytes) -> None:
+        params = (exchange_name, routing_key, payload)
+        await Result._execute(cls, ctx, db, params)
+
+
+class ClaimOutbox(Result):
+    """
+    Claims up to ``limit`` unclaimed messages for ``lease`` seconds, in id
+    order. A message claimed by a relay that went away is claimed again
+    once the lease has expired.
+    """
+    id: int
+    exchange_name: str
+    routing_key: str
+    payload: bytes
+
+    __sql__ = """\
+        UPDATE
+            outbox
+        SET
+            claimed_until = NOW() + make_interval(secs => $2)
+        WHERE
+            id IN (
+                SELECT
+                    id
+                FROM
+                    outbox
+                WHERE
+                    claimed_until IS NULL OR claimed_until < NOW()
+                ORDER BY
+                    id
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            )
+        RETURNING
+            id, exchange_name, routing_key, payload
+    """
+
+    @classmethod
+    async def exec(cls, ctx: Span, db: DbType, limit: int,
+                   lease: float) -> List['ClaimOutbox']:
+        params = (limit, lease)
+        rows = await Result._query_all(cls, ctx, db, params)
+        return sorted(rows, key=lambda row: row.id)
+
+
+class DeleteOutbox(Result):
+    __sql__ = """\
+        DELETE FROM
+            outbox
+        WHERE
+            id = ANY($1::bigint[])
+    """
+
+    @classmethod
+    async def exec(cls, ctx: Span, db: DbType, ids: Iterable[int]) -> None:
+        params = (list(ids),)
+        await Result._execute(cls, ctx, db, params)
@@ -0,0 +1,105 @@
+import asyncio
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional
+
+try:
+    _current_task = asyncio.current_task  # type: ignore
+except AttributeError:  # Python 3.6
+    _current_task = asyncio.Task.current_task
+
+_deadlines: 'weakref.WeakKeyDictionary[asyncio.Future, float]' = \
+    weakref.WeakKeyDictionary()
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """
+    The time budget of the request ran out before a query could start.
+    """
+
+
+@contextmanager
+def deadline(timeout: float) -> Iterator[None]:
+    """
+    Gives the ``Result`` calls made by the current task within the block
+    ``timeout`` seconds in total, 0 for no limit. Tasks started by
+    ``fanout`` inherit the deadline, and a nested deadline can only make it
+    earlier.
+    """
+    task = _current_task()
+    if not timeout or task is None:
+        yield
+        return
+    previous = _deadlines.get(task)
+    at = time.monotonic() + timeout
+    _deadlines[task] = at if previous is None else min(at, previous)
+    try:
+        yield
+    finally:
+        if previous is None:
+            _deadlines.pop(task, None)
+        else:
+            _deadlines[task] = previous
+
+
+def remaining() -> Optional[float]:
+    """
+    Returns the seconds left before the deadline of the current task, or
+    None if it has none.
+    """
+    task = _current_task()
+    at = _deadlines.get(task) if task is not None else None
+    return None if at is None else at - time.monotonic()
+
+
+def budget(timeout: Optional[float]) -> Optional[float]:
+    """
+    Returns the lesser of ``timeout`` and the time left before the deadline
+    of the current task, raising ``DeadlineExceeded`` if none is left.
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded()
+    return left if timeout is None else min(timeout, left)
+
+
+class Budget:
+    """
+    Time left for one call made of several steps, e.g. acquiring a
+    connection and running a query: the lesser of ``timeout`` and the
+    deadline of the current task, fixed when the budget is created.
+    """
+    __slots__ = ('_at',)
+
+    def __init__(self, timeout: Optional[float]) -> None:
+        left = budget(timeout)
+        self._at = None if left is None else time.monotonic() + left
+
+    def left(self) -> Optional[float]:
+        """
+        Returns the seconds left, None if unlimited. Raises
+        ``DeadlineExceeded`` once the deadline of the task has passed and
+        ``asyncio.TimeoutError`` once the budget is spent.
+        """
+        budget(None)
+        if self._at is None:
+            return None
+        left = self._at - time.monotonic()
+        if left <= 0:
+            raise asyncio.TimeoutError()
+        return left
+
+
+def inherit(tasks: Iterable[asyncio.Future]) -> None:
+    """
+    Gives ``tasks`` the deadline of the current task.
+    """
+    task = _current_task()
+    at = _deadlines.get(task) if task is not None else None
+    if at is None:
+        return
+    for child in tasks:
+        _deadlines[child] = at
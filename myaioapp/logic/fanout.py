@@ -0,0 +1,38 @@
+import asyncio
+from typing import Any, Awaitable, List, Optional
+from .deadline import inherit
+
+
+async def fanout(*aws: Awaitable,
+                 loop: Optional[asyncio.AbstractEventLoop] = None
+                 ) -> List[Any]:
+    """
+    Runs independent awaitables concurrently and returns their results in
+    the order they were passed.
+
+    Every awaitable must be created with the span of the calling request,
+    e.g. ``db.GetDate.exec(ctx, self.app.db)``, so the spans they open are
+    parented to it. Database calls made through the ``Postgres`` component
+    acquire their own pool connection each and run in parallel. They share
+    the deadline of the calling task.
+
+    If one of the awaitables fails, the others are cancelled and the error
+    is re-raised. The same happens when the calling task is cancelled.
+    """
+    tasks = [asyncio.ensure_future(aw, loop=loop) for aw in aws]
+    inherit(tasks)
+    if not tasks:
+        return []
+    try:
+        await asyncio.wait(tasks, loop=loop,
+                           return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        pending = [task for task in tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending, loop=loop)
+    for task in tasks:
+        if not task.cancelled() and task.exception() is not None:
+            raise task.exception()  # type: ignore
+    return [task.result() for task in tasks]
@@ -0,0 +1,61 @@
+import asyncio
+from typing import Dict, Optional
+import aioapp
+
+
+class HealthChecker(aioapp.app.Component):
+    """
+    Probes Postgres and the RabbitMq channels every ``interval`` seconds
+    in the background and caches the results, so readiness probes are
+    answered without touching either of them.
+    """
+
+    def __init__(self, interval: float, timeout: float) -> None:
+        super(HealthChecker, self).__init__()
+        self.interval = interval
+        self.timeout = timeout
+        self.status: Dict[str, bool] = {}
+        self.checked_at: Optional[float] = None
+        self._task: Optional[asyncio.Future] = None
+
+    @property
+    def ready(self) -> bool:
+        if self.checked_at is None or not self.status:
+            return False
+        if self.loop.time() - self.checked_at > self.interval * 3:
+            return False
+        return all(self.status.values())
+
+    async def prepare(self) -> None:
+        pass
+
+    async def start(self) -> None:
+        await self.check()
+        self._task = asyncio.ensure_future(self._run(), loop=self.loop)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.wait([self._task], loop=self.loop)
+            self._task = None
+
+    async def check(self) -> None:
+        app = self.app
+        status = {
+            'rabbit': app.rmq_consumer.is_open and app.rmq_publisher.is_open,
+        }
+        try:
+            await app.db.ping(timeout=self.timeout)
+            status['postgres'] = True
+        except Exception:
+            status['postgres'] = False
+        self.status = status
+        self.checked_at = self.loop.time()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval, loop=self.loop)
+            try:
+                await self.check()
+            except Exception as err:  # pragma: no cover
+                self.app.log_err(err)
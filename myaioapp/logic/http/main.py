@@ -1,8 +1,17 @@
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable
 from aiohttp import web
 import myaioapp.app  # noqa
 from aioapp.http import Handler
 from aioapp.tracer import Span
+from myaioapp.metrics import REGISTRY
 from .. import db
+from ..deadline import DeadlineExceeded, deadline
+from ..fanout import fanout
+
+HandlerType = Callable[[Span, web.Request], Awaitable[web.StreamResponse]]
 
 
 class MainHttpHandler(Handler):
@@ -16,7 +25,72 @@ class MainHttpHandler(Handler):
 
     async def prepare(self):
         self.server.error_handler = self.error_handler
-        self.server.add_route('GET', '/', self.home_get_handler)
+        self._route('GET', '/', self.home_get_handler)
+        self._route('GET', '/week', self.week_get_handler)
+        self._route('GET', '/health/live', self.live_get_handler,
+                    shed=False)
+        self._route('GET', '/health/ready', self.ready_get_handler,
+                    shed=False)
+        self._route('GET', '/metrics', self.metrics_get_handler, shed=False)
+        if self.app.profiler is not None and self.app.profiler.token:
+            self.server.add_route('GET', '/admin/profiles',
+                                  self.profiles_get_handler)
+            self.server.add_route('GET', '/admin/profiles/{name}',
+                                  self.profile_get_handler)
+
+    def _route(self, method: str, path: str,
+               handler: HandlerType, shed: bool = True) -> None:
+        """
+        Registers the route with its request count and latency recorded in
+        the metrics registry, the handler traced only if the request is
+        sampled and profiled if the profiler picks it.
+
+        Unless ``shed`` is False, the handler gets the request deadline and
+        the request is answered with a 503 when it runs out of time or when
+        too many requests already wait for a database connection.
+        """
+        async def observed(ctx: Span,
+                           request: web.Request) -> web.StreamResponse:
+            profiler = self.app.profiler
+            capture = profiler.begin(path, request) if profiler else None
+            started = time.perf_counter()
+            status = 500
+            span = self.app.tracing.begin(ctx)
+            try:
+                if shed and self._overloaded():
+                    REGISTRY.counter('http_shed_total', route=path,
+                                     reason='pool').inc()
+                    raise web.HTTPServiceUnavailable()
+                timeout = self.app.config.http_request_timeout if shed else 0
+                with deadline(timeout):
+                    resp = await handler(span, request)
+                status = resp.status
+                return resp
+            except asyncio.TimeoutError as err:
+                status = 503
+                REGISTRY.counter('http_shed_total', route=path, reason=(
+                    'deadline' if isinstance(err, DeadlineExceeded)
+                    else 'timeout')).inc()
+                raise web.HTTPServiceUnavailable()
+            except web.HTTPException as err:
+                status = err.status
+                raise
+            finally:
+                duration = time.perf_counter() - started
+                self.app.tracing.end(ctx, span, duration, status >= 500)
+                REGISTRY.histogram('http_request_duration_seconds',
+                                   method=method, route=path).observe(
+                    duration)
+                REGISTRY.counter('http_requests_total', method=method,
+                                 route=path, status=str(status)).inc()
+                if profiler is not None:
+                    await profiler.end(path, capture, duration)
+
+        self.server.add_route(method, path, observed)
+
+    def _overloaded(self) -> bool:
+        limit = self.app.config.http_shed_pool_waiting
+        return bool(limit) and self.app.db.pool_limit.waiting >= limit
 
     async def error_handler(self, ctx: Span,
                             request: web.Request,
@@ -28,18 +102,16 @@ class MainHttpHandler(Handler):
 
     async def home_get_handler(self, ctx: Span,
                                request: web.Request) -> web.Response:
-        if request.query.get('error'):
-            await db.UpdateSomeTable.exec(ctx, self.app.db, 1)
-
         if self.app.rmq_consumer.queue is None:  # pragma: nocover
             raise web.HTTPInternalServerError()
 
-        res1 = await db.GetWeek.exec(ctx, self.app.db)
-        res2 = await db.GetDate.exec(ctx, self.app.db)
+        res1, res2, _ = await fanout(
+            db.GetWeek.exec(ctx, self.app.db),
+            db.GetDate.exec(ctx, self.app.db),
+            self._publish_test_message(ctx, request),
+            loop=self.app.loop
+        )
 
-        await self.app.rmq_publisher.publish(ctx, b'test message', '',
-                                             self.app.rmq_consumer.queue,
-                                             propagate_trace=False)
         return web.Response(
             text='Hello, world!\n'
                  'Now: %s\n'
@@ -47,3 +119,66 @@ class MainHttpHandler(Handler):
                      res2.now.isoformat(),
                      ','.join([str(row.asdict()) for row in res1]))
         )
+
+    async def _publish_test_message(self, ctx: Span,
+                                    request: web.Request) -> None:
+        queue = self.app.rmq_consumer.queue
+        assert queue is not None
+        async with self.app.db.transaction(ctx) as session:
+            if request.query.get('error'):
+                await db.UpdateSomeTable.exec(ctx, session, 1)
+            await self.app.outbox.publish(ctx, session, b'test message', '',
+                                          queue)
+        self.app.outbox.notify()
+
+    async def week_get_handler(self, ctx: Span,
+                               request: web.Request) -> web.StreamResponse:
+        resp = web.StreamResponse()
+        resp.content_type = 'text/plain'
+        await resp.prepare(request)
+        rows = db.GetWeek.exec_iter(ctx, self.app.db)
+        try:
+            async for row in rows:
+                await resp.write(b'%s\n' % row.date.isoformat().encode())
+        finally:
+            # releases the cursor and its connection right away when the
+            # client goes away
+            await rows.aclose()
+        await resp.write_eof()
+        return resp
+
+    async def live_get_handler(self, ctx: Span,
+                               request: web.Request) -> web.Response:
+        return web.json_response({'live': True})
+
+    async def ready_get_handler(self, ctx: Span,
+                                request: web.Request) -> web.Response:
+        health = self.app.health
+        return web.json_response({'ready': health.ready,
+                                  'checks': health.status},
+                                 status=200 if health.ready else 503)
+
+    async def metrics_get_handler(self, ctx: Span,
+                                  request: web.Request) -> web.Response:
+        return web.Response(text=REGISTRY.render())
+
+    async def profiles_get_handler(self, ctx: Span,
+                                   request: web.Request) -> web.Response:
+        if not self.app.profiler.authorized(  # type: ignore
+                request, admin=True):
+            raise web.HTTPForbidden()
+        return web.json_response(
+            self.app.profiler.profiles())  # type: ignore
+
+    async def profile_get_handler(self, ctx: Span,
+                                  request: web.Request) -> web.FileResponse:
+        if not self.app.profiler.authorized(  # type: ignore
+                request, admin=True):
+            raise web.HTTPForbidden()
+        path = self.app.profiler.path(  # type: ignore
+            request.match_info['name'])
+        if path is None:
+            raise web.HTTPNotFound()
+        return web.FileResponse(path, headers={
+            'Content-Disposition': 'attachment; filename="%s"'
+                                   '' % os.path.basename(path)})
@@ -0,0 +1,103 @@
+import asyncio
+from typing import Optional
+import aioapp
+from aioapp.tracer import Span
+from myaioapp.metrics import REGISTRY
+from myaioapp.tracing import NOOP_SPAN
+from . import db
+
+
+class OutboxRelay(aioapp.app.Component):
+    """
+    Transactional outbox: ``publish`` stores a message in the ``outbox``
+    table within the caller's transaction, and a background task publishes
+    the committed messages through the publisher channel in batches of
+    ``batch_size``.
+
+    The task polls every ``interval`` seconds and is woken earlier by
+    ``notify``. A batch is claimed for ``lease`` seconds, published with
+    publisher confirms and the confirmed messages are deleted, each step
+    on its own pool connection, so no row lock or connection is held while
+    the broker answers. Several processes can relay the same table. A
+    message that is not confirmed is published again once its lease has
+    expired, which makes delivery at least once.
+    """
+
+    def __init__(self, batch_size: int, interval: float,
+                 lease: float = 30.) -> None:
+        super(OutboxRelay, self).__init__()
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lease = lease
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Future] = None
+
+    async def prepare(self) -> None:
+        self._wakeup = asyncio.Event(loop=self.loop)
+
+    async def start(self) -> None:
+        if not self.app.rmq_publisher.confirms:
+            raise UserWarning('The outbox relay needs publisher confirms')
+        self._task = asyncio.ensure_future(self._run(), loop=self.loop)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.wait([self._task], loop=self.loop)
+            self._task = None
+
+    async def publish(self, ctx: Span, session: db.Session, payload: bytes,
+                      exchange_name: str, routing_key: str) -> None:
+        await db.InsertOutbox.exec(ctx, session, exchange_name, routing_key,
+                                   payload)
+
+    def notify(self) -> None:
+        """
+        Wakes the relay up, to be called after the transaction that
+        published to the outbox has been committed.
+        """
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def relay(self) -> int:
+        """
+        Claims and publishes one batch of messages, deletes the ones the
+        broker confirmed and returns the size of the batch.
+        """
+        publisher = self.app.rmq_publisher
+        rows = await db.ClaimOutbox.exec(NOOP_SPAN, self.app.db,
+                                         self.batch_size, self.lease)
+        if not rows:
+            return 0
+        futures = [await publisher.publish_confirmed(NOOP_SPAN, row.payload,
+                                                     row.exchange_name,
+                                                     row.routing_key,
+                                                     propagate_trace=False)
+                   for row in rows]
+        results = await asyncio.gather(*futures, loop=self.loop,
+                                       return_exceptions=True)
+        confirmed = [row.id for row, res in zip(rows, results)
+                     if not isinstance(res, BaseException)]
+        if confirmed:
+            await db.DeleteOutbox.exec(NOOP_SPAN, self.app.db, confirmed)
+            REGISTRY.counter('outbox_relayed_total').inc(len(confirmed))
+        failed = [res for res in results if isinstance(res, BaseException)]
+        if failed:
+            raise failed[0]
+        return len(rows)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await self.relay() == self.batch_size:
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self.app.log_err(err)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(),  # type: ignore
+                                       self.interval, loop=self.loop)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()  # type: ignore
@@ -0,0 +1,273 @@
+import time
+import socket
+import asyncio
+from bisect import bisect_left
+from urllib.parse import urlparse
+from typing import (Any, Dict, Iterator, List, Optional, Sequence, Tuple,
+                    Union)
+import aioapp
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5,
+                   1., 2.5, 5., 10.)
+MAX_DATAGRAM_SIZE = 8192
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Counter:
+    __slots__ = ('name', 'labels', 'value')
+
+    def __init__(self, name: str, labels: Labels) -> None:
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, value: int = 1) -> None:
+        self.value += value
+
+
+class Gauge:
+    __slots__ = ('name', 'labels', 'value')
+
+    def __init__(self, name: str, labels: Labels) -> None:
+        self.name = name
+        self.labels = labels
+        self.value = 0.
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Histogram:
+    __slots__ = ('name', 'labels', 'buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, name: str, labels: Labels,
+                 buckets: Sequence[float]) -> None:
+        self.name = name
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> Iterator[Tuple[str, int]]:
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield '%g' % bound, total
+        yield '+Inf', total + self.counts[-1]
+
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+class Registry:
+    """
+    In-process aggregation of counters, gauges and fixed-bucket histograms.
+
+    All updates happen on the event loop thread, so the metrics are plain
+    integers and floats updated without locks.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[Tuple[str, Labels], Metric] = {}
+
+    def counter(self, name: str, **labels: str) -> Counter:
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            metric = self._metrics[key] = Counter(name, key[1])
+        return metric  # type: ignore
+
+    def gauge(self, name: str, **labels: str) -> Gauge:
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            metric = self._metrics[key] = Gauge(name, key[1])
+        return metric  # type: ignore
+
+    def histogram(self, name: str,
+                  buckets: Sequence[float] = DEFAULT_BUCKETS,
+                  **labels: str) -> Histogram:
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            metric = self._metrics[key] = Histogram(name, key[1], buckets)
+        return metric  # type: ignore
+
+    def clear(self) -> None:
+        self._metrics.clear()
+
+    def render(self) -> str:
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        lines: List[str] = []
+        typed = set()
+        for (name, labels), metric in sorted(self._metrics.items()):
+            if isinstance(metric, Counter):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append('# TYPE %s counter' % name)
+                lines.append('%s%s %d' % (name, _prom_labels(labels),
+                                          metric.value))
+                continue
+            if isinstance(metric, Gauge):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append('# TYPE %s gauge' % name)
+                lines.append('%s%s %r' % (name, _prom_labels(labels),
+                                          float(metric.value)))
+                continue
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE %s histogram' % name)
+            for le, count in metric.cumulative():
+                lines.append('%s_bucket%s %d' % (
+                    name, _prom_labels(labels + (('le', le),)), count))
+            lines.append('%s_sum%s %r' % (name, _prom_labels(labels),
+                                          metric.sum))
+            lines.append('%s_count%s %d' % (name, _prom_labels(labels),
+                                            metric.count))
+        return '\n'.join(lines) + '\n'
+
+    def influx_lines(self, prefix: str = '',
+                     ts: Optional[int] = None) -> List[str]:
+        """
+        Returns all metrics as InfluxDB line protocol, one line per counter,
+        per gauge and per histogram bucket.
+        """
+        if ts is None:
+            ts = int(time.time() * 1e9)
+        lines = []
+        for (name, labels), metric in self._metrics.items():
+            if isinstance(metric, Counter):
+                lines.append('%s%s%s value=%di %d' % (
+                    prefix, name, _influx_tags(labels), metric.value, ts))
+                continue
+            if isinstance(metric, Gauge):
+                lines.append('%s%s%s value=%r %d' % (
+                    prefix, name, _influx_tags(labels), float(metric.value),
+                    ts))
+                continue
+            for le, count in metric.cumulative():
+                lines.append('%s%s_bucket%s value=%di %d' % (
+                    prefix, name, _influx_tags(labels + (('le', le),)),
+                    count, ts))
+            lines.append('%s%s%s sum=%r,count=%di %d' % (
+                prefix, name, _influx_tags(labels), metric.sum,
+                metric.count, ts))
+        return lines
+
+
+REGISTRY = Registry()
+
+
+class Timer:
+    """
+    Context manager observing the duration of its block in a histogram.
+    """
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram: Histogram) -> None:
+        self.histogram = histogram
+        self.started = 0.
+
+    def __enter__(self) -> 'Timer':
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class MetricsFlusher(aioapp.app.Component):
+    """
+    Sends the pre-aggregated registry to the UDP metrics collector (the
+    telegraf-influx driver's ``METRICS_URL``) every ``interval`` seconds,
+    packing many lines per datagram. The collector address is resolved
+    once, when the component is prepared.
+    """
+
+    def __init__(self, url: str, prefix: str, interval: float,
+                 registry: Registry = REGISTRY) -> None:
+        super(MetricsFlusher, self).__init__()
+        self.url = urlparse(url)
+        self.prefix = prefix
+        self.interval = interval
+        self.registry = registry
+        self._sock: Optional[socket.socket] = None
+        self._addr: Any = None
+        self._task: Optional[asyncio.Future] = None
+
+    async def prepare(self) -> None:
+        if self.url.scheme != 'udp':
+            raise UserWarning('Unsupported metrics url scheme %r'
+                              '' % self.url.scheme)
+        (family, type_, proto, _, self._addr), *_ = \
+            await self.loop.getaddrinfo(self.url.hostname, self.url.port,
+                                        type=socket.SOCK_DGRAM)
+        self._sock = socket.socket(family, type_, proto)
+        self._sock.setblocking(False)
+
+    async def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run(), loop=self.loop)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.wait([self._task], loop=self.loop)
+            self._task = None
+        self.flush()
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def flush(self) -> None:
+        if self._sock is None:
+            return
+        for datagram in _datagrams(self.registry.influx_lines(self.prefix)):
+            try:
+                self._sock.sendto(datagram, self._addr)
+            except OSError as err:
+                self.app.log_err(err)
+                return
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval, loop=self.loop)
+            self.flush()
+
+
+def _datagrams(lines: List[str]) -> Iterator[bytes]:
+    chunk: List[bytes] = []
+    size = 0
+    for line in lines:
+        data = line.encode() + b'\n'
+        if chunk and size + len(data) > MAX_DATAGRAM_SIZE:
+            yield b''.join(chunk)
+            chunk, size = [], 0
+        chunk.append(data)
+        size += len(data)
+    if chunk:
+        yield b''.join(chunk)
+
+
+def _prom_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(val).replace('\\', '\\\\').replace('"', '\\"'))
+        for key, val in labels)
+
+
+def _influx_tags(labels: Labels) -> str:
+    return ''.join(
+        ',%s=%s' % (key, str(val).replace(' ', '\\ ').replace(',', '\\,')
+                    .replace('=', '\\='))
+        for key, val in labels)
@@ -0,0 +1,87 @@
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from typing import Optional
+import aioapp
+from myaioapp.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+class LoopMonitor(aioapp.app.Component):
+    """
+    Measures how late the event loop wakes a task sleeping ``interval``
+    seconds and records it in the ``loop_lag_seconds`` histogram.
+
+    A lag of at least ``threshold`` seconds means a callback blocked the
+    loop. It is counted in the ``loop_blocked_seconds`` histogram and
+    logged with the stack the loop thread was executing, which a watchdog
+    thread captures while the loop is still blocked.
+    """
+
+    def __init__(self, interval: float, threshold: float) -> None:
+        super(LoopMonitor, self).__init__()
+        self.interval = interval
+        self.threshold = threshold
+        self._task: Optional[asyncio.Future] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._loop_thread: Optional[int] = None
+        self._wakeup = 0.
+        self._stack: Optional[str] = None
+        self._stack_wakeup = 0.
+
+    async def prepare(self) -> None:
+        pass
+
+    async def start(self) -> None:
+        self._loop_thread = threading.get_ident()
+        self._wakeup = time.monotonic() + self.interval
+        self._stopped.clear()
+        self._task = asyncio.ensure_future(self._run(), loop=self.loop)
+        self._watchdog = threading.Thread(target=self._watch,
+                                          name='loop-monitor', daemon=True)
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.wait([self._task], loop=self.loop)
+            self._task = None
+        if self._watchdog is not None:
+            # the watchdog wakes up every threshold / 2 seconds to see the
+            # stop event, join it off the loop
+            await self.loop.run_in_executor(None, self._watchdog.join,
+                                            self.threshold)
+            self._watchdog = None
+
+    async def _run(self) -> None:
+        lag = REGISTRY.histogram('loop_lag_seconds')
+        blocked = REGISTRY.histogram('loop_blocked_seconds')
+        while True:
+            self._wakeup = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval, loop=self.loop)
+            delay = max(0., time.monotonic() - self._wakeup)
+            lag.observe(delay)
+            if delay < self.threshold:
+                continue
+            blocked.observe(delay)
+            stack, self._stack = self._stack, None
+            logger.warning('Event loop was blocked for %.3fs%s', delay,
+                           ', in:\n%s' % stack if stack else '')
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.threshold / 2):
+            wakeup = self._wakeup
+            if (wakeup == self._stack_wakeup or
+                    time.monotonic() - wakeup < self.threshold):
+                continue
+            frames = sys._current_frames()
+            frame = frames.get(self._loop_thread)  # type: ignore
+            if frame is not None:
+                self._stack = ''.join(traceback.format_stack(frame))
+                self._stack_wakeup = wakeup
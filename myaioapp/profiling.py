@@ -0,0 +1,160 @@
+import hmac
+import io
+import os
+import re
+import time
+import random
+import pstats
+import asyncio
+import cProfile
+import tracemalloc
+from typing import Dict, List, Optional, Set
+from aiohttp import web
+
+TRIGGER_HEADER = 'X-Profile'
+TOP_STATS = 50
+
+
+class _Capture:
+    __slots__ = ('route', 'profile', 'snapshot', 'tracing', 'started')
+
+    def __init__(self, route: str) -> None:
+        self.route = route
+        self.tracing = tracemalloc.is_tracing()
+        if not self.tracing:
+            tracemalloc.start()
+        self.snapshot = tracemalloc.take_snapshot()
+        self.profile = cProfile.Profile()
+        self.started = time.time()
+        self.profile.enable()
+
+    def stop(self) -> tracemalloc.Snapshot:
+        self.profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        if not self.tracing:
+            tracemalloc.stop()
+        return snapshot
+
+
+class Profiler:
+    """
+    Profiles sampled HTTP requests with cProfile and tracemalloc.
+
+    A request is profiled when it carries the ``X-Profile`` header (equal
+    to ``token`` if one is set), when it is picked with ``sample_rate``
+    probability, or when the previous request of its route took longer
+    than ``slow_threshold`` seconds.
+
+    cProfile and tracemalloc see the whole event loop thread, so the
+    capture also includes the tasks of other requests running at the same
+    time. Only one request is profiled at a time to keep that noise and
+    the overhead bounded. Every capture is written to ``directory`` as a
+    ``.prof`` file loadable by ``pstats`` and a ``.txt`` summary with the
+    hottest functions and the allocation diff; only the ``max_files``
+    newest captures are kept. The captures can only be downloaded with a
+    ``token``.
+    """
+
+    def __init__(self, directory: str,
+                 max_files: int = 20,
+                 sample_rate: float = 0.,
+                 slow_threshold: float = 0.,
+                 token: Optional[str] = None,
+                 loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        self.directory = directory
+        self.max_files = max_files
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.token = token
+        self.loop = loop
+        self._active: Optional[_Capture] = None
+        self._armed: Set[str] = set()
+
+    def authorized(self, request: web.Request, admin: bool = False) -> bool:
+        """
+        Checks the ``X-Profile`` header of ``request``. Without a ``token``
+        any value triggers a capture, but the ``admin`` access to the
+        stored captures is always refused.
+        """
+        value = request.headers.get(TRIGGER_HEADER)
+        if value is None:
+            return False
+        if not self.token:
+            return not admin
+        return hmac.compare_digest(value, self.token)
+
+    def begin(self, route: str,
+              request: web.Request) -> Optional[_Capture]:
+        if self._active is not None:
+            return None
+        if route in self._armed:
+            self._armed.discard(route)
+        elif not (self.authorized(request) or
+                  random.random() < self.sample_rate):  # nosec
+            return None
+        self._active = _Capture(route)
+        return self._active
+
+    async def end(self, route: str, capture: Optional[_Capture],
+                  duration: float) -> None:
+        if capture is None:
+            if 0 < self.slow_threshold <= duration:
+                self._armed.add(route)
+            return
+        snapshot = capture.stop()
+        self._active = None
+        await self.loop.run_in_executor(  # type: ignore
+            None, self._save, capture, snapshot, duration)
+
+    def profiles(self) -> List[Dict[str, object]]:
+        """
+        Lists the stored captures, newest first.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        res = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if not name.endswith(('.prof', '.txt')):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            res.append({'name': name, 'size': stat.st_size,
+                        'mtime': stat.st_mtime})
+        return res
+
+    def path(self, name: str) -> Optional[str]:
+        if name not in {item['name'] for item in self.profiles()}:
+            return None
+        return os.path.join(self.directory, name)
+
+    def _save(self, capture: _Capture, snapshot: tracemalloc.Snapshot,
+              duration: float) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, '%d-%s' % (
+            capture.started * 1e6, re.sub(r'\W+', '_', capture.route)))
+        capture.profile.dump_stats(base + '.prof')
+
+        out = io.StringIO()
+        out.write('route: %s\nduration: %.6fs\n\n' % (capture.route,
+                                                      duration))
+        stats = pstats.Stats(capture.profile, stream=out)
+        stats.sort_stats('cumulative').print_stats(TOP_STATS)
+        out.write('\nallocations:\n')
+        ignore = (tracemalloc.Filter(False, tracemalloc.__file__),)
+        diff = snapshot.filter_traces(ignore).compare_to(
+            capture.snapshot.filter_traces(ignore), 'lineno')
+        for stat in diff[:TOP_STATS]:
+            out.write('%s\n' % stat)
+        with open(base + '.txt', 'w') as f:
+            f.write(out.getvalue())
+        self._rotate()
+
+    def _rotate(self) -> None:
+        captures = sorted({name.rsplit('.', 1)[0]
+                           for name in os.listdir(self.directory)
+                           if name.endswith(('.prof', '.txt'))})
+        for base in captures[:-self.max_files]:
+            for ext in ('.prof', '.txt'):
+                try:
+                    os.remove(os.path.join(self.directory, base + ext))
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,114 @@
+import os
+import copy
+import time
+import signal
+import asyncio
+import logging
+from typing import Callable, Dict
+from aioapp.config import ConfigError
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+RESTART_DELAY = 1.0
+
+
+def worker_config(config: Config, workers: int) -> Config:
+    """
+    Returns a copy of the config for one of ``workers`` processes, with the
+    database pool split so all workers together keep the configured
+    connection budget. Raises ``ConfigError`` if there are more workers
+    than connections in the budget.
+    """
+    if workers > config.db_pool_max_size:
+        raise ConfigError('%d workers need DB_POOL_MAX_SIZE of at least %d, '
+                          'got %d' % (workers, workers,
+                                      config.db_pool_max_size))
+    config = copy.copy(config)
+    config.db_pool_max_size = config.db_pool_max_size // workers
+    config.db_pool_min_size = min(config.db_pool_min_size,
+                                  config.db_pool_max_size)
+    return config
+
+
+def reuse_port(loop: asyncio.AbstractEventLoop) -> None:
+    """
+    Makes every server created on the loop bind with SO_REUSEPORT, so the
+    workers share the HTTP port and the kernel balances connections
+    between them.
+    """
+    create_server = loop.create_server
+
+    def create_server_reuse_port(*args, **kwargs):
+        kwargs['reuse_port'] = True
+        return create_server(*args, **kwargs)
+
+    loop.create_server = create_server_reuse_port  # type: ignore
+
+
+class Supervisor:
+    """
+    Forks ``workers`` processes running ``target`` with their own event
+    loop, restarts the ones that crash and forwards SIGTERM/SIGINT to all
+    of them for a graceful shutdown.
+    """
+
+    def __init__(self, config: Config, workers: int,
+                 target: Callable[[Config], int]) -> None:
+        self.config = worker_config(config, workers)
+        self.workers = workers
+        self.target = target
+        self._pids: Dict[int, float] = {}
+        self._stopping = False
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for _ in range(self.workers):
+            self._spawn()
+        code = 0
+        while self._pids:
+            pid, status = os.wait()
+            started = self._pids.pop(pid, None)
+            if started is None:
+                continue
+            exit_code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1
+            if self._stopping:
+                if (os.WIFSIGNALED(status) and
+                        os.WTERMSIG(status) == signal.SIGTERM):
+                    exit_code = 0
+                code = code or exit_code
+                continue
+            logger.error('Worker %s exited with code %s, restarting',
+                         pid, exit_code)
+            if time.monotonic() - started < RESTART_DELAY:
+                time.sleep(RESTART_DELAY)
+            if not self._stopping:
+                self._spawn()
+        return code
+
+    def _spawn(self) -> None:
+        pid = os.fork()
+        if pid:
+            self._pids[pid] = time.monotonic()
+            return
+        code = 1
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            reuse_port(loop)
+            code = self.target(self.config)
+        except Exception:
+            logger.exception('Worker %s failed', os.getpid())
+        finally:
+            os._exit(code)
+
+    def _stop(self, signum, frame) -> None:
+        self._stopping = True
+        for pid in self._pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:  # pragma: no cover
+                pass
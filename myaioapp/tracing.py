@@ -0,0 +1,436 @@
+import gzip
+import json
+import time
+import random
+import asyncio
+import logging
+import weakref
+from collections import deque
+from urllib.parse import urljoin
+from typing import Any, Deque, List, Optional, Tuple, Union
+import aiohttp
+import aioapp
+from aioapp.tracer import Span
+from myaioapp.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+MAX_RECORDED_SPANS = 256
+
+
+class Sampler:
+    """
+    Head sampling decision taken once per incoming request or message.
+    """
+
+    def sample(self) -> bool:  # pragma: no cover
+        raise NotImplementedError()
+
+
+class ConstSampler(Sampler):
+
+    def __init__(self, sampled: bool) -> None:
+        self.sampled = sampled
+
+    def sample(self) -> bool:
+        return self.sampled
+
+
+class ProbabilisticSampler(Sampler):
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+
+    def sample(self) -> bool:
+        return random.random() < self.rate  # nosec
+
+
+class RateLimitingSampler(Sampler):
+    """
+    Token bucket letting through at most ``per_second`` traces a second,
+    with bursts of up to one second's worth.
+    """
+
+    def __init__(self, per_second: float) -> None:
+        self.per_second = per_second
+        self._tokens = per_second
+        self._updated = time.monotonic()
+
+    def sample(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(self.per_second,
+                           self._tokens +
+                           (now - self._updated) * self.per_second)
+        self._updated = now
+        if self._tokens < 1.:
+            return False
+        self._tokens -= 1.
+        return True
+
+
+def create_sampler(name: str, param: float) -> Sampler:
+    if name == 'const':
+        return ConstSampler(param > 0)
+    if name == 'probabilistic':
+        return ProbabilisticSampler(param)
+    if name == 'ratelimiting':
+        return RateLimitingSampler(param)
+    raise UserWarning('Unsupported tracer sampler %r' % name)
+
+
+class NoopSpan:
+    """
+    Stand-in for the span of an unsampled request: every child is the same
+    object and every call does nothing, so no span objects are built on the
+    request path. Methods of ``aioapp.tracer.Span`` it does not define are
+    ignored as well.
+    """
+    __slots__ = ('__weakref__',)
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self._ignore
+
+    def _ignore(self, *args, **kwargs) -> 'NoopSpan':
+        return self
+
+    def new_child(self, name: Optional[str] = None,
+                  kind: Optional[str] = None) -> 'NoopSpan':
+        return self
+
+    def start(self, ts: Optional[float] = None) -> 'NoopSpan':
+        return self
+
+    def finish(self, ts: Optional[float] = None,
+               exception: Optional[BaseException] = None) -> 'NoopSpan':
+        return self
+
+    def name(self, name: str) -> 'NoopSpan':
+        return self
+
+    set_name = name
+
+    def kind(self, kind: str) -> 'NoopSpan':
+        return self
+
+    def tag(self, key: str, value: Any) -> 'NoopSpan':
+        return self
+
+    def metrics_tag(self, key: str, value: Any) -> 'NoopSpan':
+        return self
+
+    def annotate(self, value: str,
+                 ts: Optional[float] = None) -> 'NoopSpan':
+        return self
+
+    def remote_endpoint(self, *args, **kwargs) -> 'NoopSpan':
+        return self
+
+    def make_headers(self) -> dict:
+        return {}
+
+    def __enter__(self) -> 'NoopSpan':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class RecordingSpan:
+    """
+    Cheap in-memory span tree of a request that lost the head sampling
+    decision. It is replayed as real spans only if the request turns out
+    slow or failed, and dropped otherwise. Methods of
+    ``aioapp.tracer.Span`` it does not define are ignored.
+    """
+    __slots__ = ('_name', '_kind', '_root', '_size', 'started', 'finished',
+                 'error', 'tags', 'annotations', 'children', '__weakref__')
+
+    def __init__(self, name: Optional[str] = None,
+                 kind: Optional[str] = None,
+                 root: Optional['RecordingSpan'] = None) -> None:
+        self._name = name
+        self._kind = kind
+        self._root = root or self
+        self._size = 1
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.error: Optional[BaseException] = None
+        self.tags: List[Tuple[str, Any, bool]] = []
+        self.annotations: List[Tuple[str, Optional[float]]] = []
+        self.children: List['RecordingSpan'] = []
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self._ignore
+
+    def _ignore(self, *args, **kwargs) -> 'RecordingSpan':
+        return self
+
+    def new_child(self, name: Optional[str] = None,
+                  kind: Optional[str] = None
+                  ) -> Union['RecordingSpan', NoopSpan]:
+        if self._root._size >= MAX_RECORDED_SPANS:
+            return NOOP_SPAN
+        self._root._size += 1
+        child = RecordingSpan(name, kind, self._root)
+        self.children.append(child)
+        return child
+
+    def start(self, ts: Optional[float] = None) -> 'RecordingSpan':
+        self.started = time.time() if ts is None else ts
+        return self
+
+    def finish(self, ts: Optional[float] = None,
+               exception: Optional[BaseException] = None
+               ) -> 'RecordingSpan':
+        self.finished = time.time() if ts is None else ts
+        self.error = exception
+        return self
+
+    def name(self, name: str) -> 'RecordingSpan':
+        self._name = name
+        return self
+
+    set_name = name
+
+    def kind(self, kind: str) -> 'RecordingSpan':
+        self._kind = kind
+        return self
+
+    def tag(self, key: str, value: Any) -> 'RecordingSpan':
+        self.tags.append((key, value, False))
+        return self
+
+    def metrics_tag(self, key: str, value: Any) -> 'RecordingSpan':
+        self.tags.append((key, value, True))
+        return self
+
+    def annotate(self, value: str,
+                 ts: Optional[float] = None) -> 'RecordingSpan':
+        self.annotations.append((value, ts))
+        return self
+
+    def remote_endpoint(self, *args, **kwargs) -> 'RecordingSpan':
+        return self
+
+    def make_headers(self) -> dict:
+        return {}
+
+    def replay(self, parent: Span) -> None:
+        """
+        Creates the recorded children as real spans under ``parent``, with
+        their original timestamps.
+        """
+        for rec in self.children:
+            span = parent.new_child(rec._name, rec._kind)
+            span.start(ts=rec.started)
+            for key, value, metrics in rec.tags:
+                if metrics:
+                    span.metrics_tag(key, value)
+                else:
+                    span.tag(key, value)
+            for value, ts in rec.annotations:
+                span.annotate(value, ts=ts)
+            rec.replay(span)
+            span.finish(ts=rec.finished, exception=rec.error)
+
+    def __enter__(self) -> 'RecordingSpan':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.finish(exception=exc_val)
+
+
+def is_recording(span: Any) -> bool:
+    """
+    Tells whether tags set on the span are kept, so the tracer config hooks
+    can skip building them for unsampled requests.
+    """
+    return not isinstance(span, NoopSpan)
+
+
+class TraceSampler:
+    """
+    Decides which requests get traced.
+
+    Once ``install``-ed on the aioapp tracer, the head sampler decides when
+    the root span of a request without an incoming sampling decision is
+    created, so the root span of a dropped request is not recorded either.
+    It is still recorded when slow or failed traces are kept, to have a
+    parent to replay them under.
+
+    ``begin`` returns the span the request handler should use: the real one
+    if the head sampler picks the request, otherwise a ``RecordingSpan``
+    when slow or failed traces are kept, or the ``NOOP_SPAN``. ``end``
+    replays a recorded trace under the real span when the request took at
+    least ``slow_threshold`` seconds or failed.
+    """
+
+    def __init__(self, sampler: Sampler,
+                 slow_threshold: float = 0.,
+                 keep_errors: bool = False) -> None:
+        self.sampler = sampler
+        self.slow_threshold = slow_threshold
+        self.keep_errors = keep_errors
+        self._decisions: 'weakref.WeakKeyDictionary[Any, bool]' = \
+            weakref.WeakKeyDictionary()
+
+    def install(self, tracer: Any) -> None:
+        """
+        Takes the head sampling decision in ``tracer.new_trace``.
+        """
+        new_trace = getattr(tracer, 'new_trace', None)
+        if new_trace is None:
+            logger.warning('Tracer has no new_trace, root spans are '
+                           'sampled by TRACER_DEFAULT_SAMPLED')
+            return
+
+        def sampled_new_trace(sampled: Optional[bool] = None,
+                              debug: bool = False) -> Span:
+            if sampled is not None:
+                return new_trace(sampled=sampled, debug=debug)
+            decision = self.sampler.sample()
+            root = new_trace(sampled=decision or self._keeps_traces,
+                             debug=debug)
+            self._decisions[root] = decision
+            return root
+
+        tracer.new_trace = sampled_new_trace
+
+    @property
+    def _keeps_traces(self) -> bool:
+        return self.slow_threshold > 0 or self.keep_errors
+
+    def begin(self, ctx: Span) -> Span:
+        decision = self._decisions.pop(ctx, None)
+        if decision is None:
+            decision = self.sampler.sample()
+        if decision:
+            REGISTRY.counter('traces_total', decision='sampled').inc()
+            return ctx
+        if self._keeps_traces:
+            return RecordingSpan()  # type: ignore
+        REGISTRY.counter('traces_total', decision='dropped').inc()
+        return NOOP_SPAN  # type: ignore
+
+    def end(self, ctx: Span, span: Span, duration: float,
+            error: bool = False) -> None:
+        if not isinstance(span, RecordingSpan):
+            return
+        if error and self.keep_errors:
+            decision = 'error'
+        elif 0 < self.slow_threshold <= duration:
+            decision = 'slow'
+        else:
+            REGISTRY.counter('traces_total', decision='dropped').inc()
+            return
+        REGISTRY.counter('traces_total', decision=decision).inc()
+        ctx.tag('sampling.kept', decision)
+        span.replay(ctx)
+
+
+class SpanExporter(aioapp.app.Component):
+    """
+    Transport for the zipkin tracer that keeps finished spans in a bounded
+    queue and posts them gzipped, in batches of up to ``batch_size`` spans,
+    from a background task every ``interval`` seconds or as soon as a full
+    batch is queued.
+
+    ``send`` never blocks the request: when the queue is full the span is
+    dropped and counted, and a slow or unavailable collector only delays
+    the background task.
+    """
+
+    def __init__(self, url: str,
+                 batch_size: int = 100,
+                 interval: float = 1.,
+                 max_queue_size: int = 10000,
+                 timeout: float = 5.) -> None:
+        super(SpanExporter, self).__init__()
+        self.url = urljoin(url, 'api/v2/spans')
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_queue_size = max_queue_size
+        self.timeout = timeout
+        self._queue: Deque[Any] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._task: Optional[asyncio.Future] = None
+
+    async def prepare(self) -> None:
+        self._wakeup = asyncio.Event(loop=self.loop)
+        self._session = aiohttp.ClientSession(loop=self.loop)
+        tracer = getattr(getattr(self.app, 'tracer', None), 'tracer', None)
+        if tracer is None or not hasattr(tracer, '_transport'):
+            logger.warning('Tracer has no zipkin transport, '
+                           'spans are not exported in batches')
+            return
+        transport, tracer._transport = tracer._transport, self
+        await transport.close()
+
+    async def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run(), loop=self.loop)
+
+    async def stop(self) -> None:
+        await self.close()
+
+    def send(self, record: Any) -> None:
+        if len(self._queue) >= self.max_queue_size:
+            REGISTRY.counter('tracer_spans_dropped_total').inc()
+            return
+        self._queue.append(record)
+        if len(self._queue) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.wait([self._task], loop=self.loop)
+            self._task = None
+        if self._session is not None:
+            await self.flush()
+            await self._session.close()
+            self._session = None
+
+    async def flush(self) -> None:
+        while self._queue:
+            batch = [self._queue.popleft()
+                     for _ in range(min(self.batch_size, len(self._queue)))]
+            await self._post(batch)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(),  # type: ignore
+                                       self.interval, loop=self.loop)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()  # type: ignore
+            await self.flush()
+
+    async def _post(self, batch: List[Any]) -> None:
+        data = gzip.compress(
+            json.dumps([record.asdict() for record in batch]).encode(),
+            compresslevel=1)
+        try:
+            async with self._session.post(  # type: ignore
+                    self.url, data=data,
+                    headers={'Content-Type': 'application/json',
+                             'Content-Encoding': 'gzip'},
+                    timeout=self.timeout) as resp:
+                if resp.status >= 300:
+                    raise UserWarning('Tracer responded with %s: %s'
+                                      '' % (resp.status, await resp.text()))
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            REGISTRY.counter('tracer_spans_dropped_total').inc(len(batch))
+            self.app.log_err(err)
+            return
+        REGISTRY.counter('tracer_spans_exported_total').inc(len(batch))
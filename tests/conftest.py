@@ -22,6 +22,7 @@ import asyncpg
 from .misc import get_free_port, DbClient
 from myaioapp.app import Application
 from myaioapp.config import Config
+from myaioapp.logic.db import migrate
 from compose.service import ImageType
 from compose.project import Project
 
@@ -277,6 +278,7 @@ async def server(loop, compose,
     print('\n'.join(['%s=%s' % (k, env[k]) for k in sorted(env.keys())]))
 
     config = Config(env)
+    await migrate(config.db_url, loop=loop)
     app = Application(loop=loop, config=config)
 
     await app.run_prepare()
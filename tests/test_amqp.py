@@ -0,0 +1,177 @@
+import asyncio
+import mock
+from types import SimpleNamespace
+import pytest
+from aioamqp.exceptions import PublishFailed
+from benchmarks.fakes import FakeAmqp, FakePostgres
+from myaioapp.logic.amqp import AmqpConsumerChannel, AmqpPublisherChannel
+from myaioapp.logic.amqp.acks import AckCoalescer
+from myaioapp.logic.db import InsertOutbox
+from myaioapp.logic.outbox import OutboxRelay
+from myaioapp.tracing import NOOP_SPAN, ConstSampler, TraceSampler
+
+
+async def test_ack_coalescer_out_of_order(loop):
+    acks = []
+
+    async def ack(ctx, delivery_tag, multiple):
+        acks.append((delivery_tag, multiple))
+
+    coalescer = AckCoalescer(ack, max_pending=2, max_delay=10, loop=loop)
+    for tag in (1, 2, 3, 4):
+        coalescer.delivered(tag)
+    coalescer.completed(None, 2)
+    coalescer.completed(None, 3)
+    await asyncio.sleep(0, loop=loop)
+    assert acks == []
+
+    coalescer.completed(None, 1)
+    await asyncio.sleep(0, loop=loop)
+    assert acks == [(3, True)]
+
+    coalescer.delivered(5)
+    coalescer.completed(None, 5)
+    await coalescer.close()
+    assert acks == [(3, True), (5, False)]
+
+
+async def test_ack_coalescer_max_delay(loop):
+    acks = []
+
+    async def ack(ctx, delivery_tag, multiple):
+        acks.append((delivery_tag, multiple))
+
+    coalescer = AckCoalescer(ack, max_pending=10, max_delay=.01, loop=loop)
+    coalescer.delivered(1)
+    coalescer.completed(None, 1)
+    assert acks == []
+    await asyncio.sleep(.05, loop=loop)
+    assert acks == [(1, True)]
+
+
+async def _publisher(loop, **kwargs):
+    channel = AmqpPublisherChannel(**kwargs)
+    amqp = FakeAmqp([channel], latency=.001)
+    amqp.loop = loop
+    amqp.app = SimpleNamespace(log_err=lambda err: None)
+    await amqp.prepare()
+    return channel, amqp
+
+
+class _Consumer(AmqpConsumerChannel):
+    processed: list
+
+    async def process(self, ctx, channel, body, envelope, properties):
+        await asyncio.sleep(.001, loop=self.amqp.loop)
+        self.processed.append(body)
+
+
+async def test_consumer_prefetch(loop):
+    with pytest.raises(UserWarning):
+        AmqpConsumerChannel(prefetch_count=3, concurrency=2)
+    channel = _Consumer(concurrency=2, ack_batch_size=2, ack_max_delay=.01)
+    channel.processed = []
+    amqp = FakeAmqp([channel], latency=.001)
+    amqp.loop = loop
+    amqp.app = SimpleNamespace(log_err=lambda err: None,
+                               tracing=TraceSampler(ConstSampler(False)))
+    await amqp.prepare()
+    await amqp.start()
+    assert channel.prefetch_count == 2
+    for i in range(10):
+        amqp.deliver(channel.queue, b'%d' % i)
+    assert len(channel._channel.unacked) == 2
+    for _ in range(100):
+        await asyncio.sleep(.005, loop=loop)
+        if len(channel.processed) == 10:
+            break
+    assert sorted(channel.processed) == sorted(b'%d' % i for i in range(10))
+    await amqp.stop()
+    assert not channel._channel.unacked
+
+
+async def test_publisher_buffered(loop):
+    channel, amqp = await _publisher(loop, batch_size=3,
+                                     batch_max_delay=.01)
+    with pytest.raises(UserWarning):
+        channel.publish_buffered(NOOP_SPAN, b'0', '', 'q')
+    await amqp.start()
+    futs = [channel.publish_buffered(NOOP_SPAN, b'%d' % i, '', 'q')
+            for i in range(4)]
+    await asyncio.wait(futs[:3], loop=loop)
+    assert amqp.published == [b'0', b'1', b'2']
+    assert not futs[3].done()
+    await asyncio.sleep(.05, loop=loop)
+    assert futs[3].done()
+    futs.append(channel.publish_buffered(NOOP_SPAN, b'4', '', 'q'))
+    await amqp.stop()
+    assert futs[4].done()
+    assert amqp.published == [b'0', b'1', b'2', b'3', b'4']
+
+
+async def test_publisher_buffered_confirms(loop):
+    channel, amqp = await _publisher(loop, confirms=True, max_in_flight=2,
+                                     batch_size=3, batch_max_delay=10)
+    await amqp.start()
+    amqp.nacks[b'1'] = 1
+    futs = [channel.publish_buffered(NOOP_SPAN, b'%d' % i, '', 'q')
+            for i in range(3)]
+    await asyncio.wait(futs, loop=loop)
+    assert futs[0].result() is None
+    with pytest.raises(PublishFailed):
+        futs[1].result()
+    assert futs[2].result() is None
+    assert sorted(amqp.published) == [b'0', b'2']
+    await amqp.stop()
+
+
+async def test_outbox_relay_keeps_nacked(loop):
+    channel, amqp = await _publisher(loop, confirms=True)
+    db = FakePostgres(latency=.001, pool_size=2)
+    db.loop = loop
+    await db.prepare()
+    relay = OutboxRelay(batch_size=10, interval=1, lease=60)
+    relay.loop = loop
+    relay.app = SimpleNamespace(db=db, rmq_publisher=AmqpPublisherChannel())
+    with pytest.raises(UserWarning):
+        await relay.start()
+    relay.app.rmq_publisher = channel
+    await amqp.start()
+    for payload in (b'1', b'2', b'3'):
+        await InsertOutbox.exec(NOOP_SPAN, db, '', 'q', payload)
+    amqp.nacks[b'2'] = channel.max_redeliveries + 1
+    with pytest.raises(PublishFailed):
+        await relay.relay()
+    assert amqp.published == [b'1', b'3']
+    assert db.pool_limit.in_use == 0
+    assert await relay.relay() == 0
+    await amqp.stop()
+
+
+async def test_publisher_confirms_redelivery(loop):
+    channel, amqp = await _publisher(loop, confirms=True, max_in_flight=2,
+                                     max_redeliveries=2)
+    await amqp.start()
+    amqp.nacks[b'1'] = 1
+    amqp.nacks[b'3'] = 3
+    futs = [await channel.publish_confirmed(NOOP_SPAN, b'%d' % i, '', 'q')
+            for i in range(1, 4)]
+    await asyncio.wait(futs, loop=loop)
+    assert futs[0].result() is None
+    assert futs[1].result() is None
+    with pytest.raises(PublishFailed):
+        futs[2].result()
+    assert amqp.published == [b'2', b'1']
+    assert channel._window._value == 2
+    await amqp.stop()
+
+
+async def test_publisher_stop_fails_unconfirmed(loop):
+    channel, amqp = await _publisher(loop, confirms=True)
+    await amqp.start()
+    amqp.latency = 10
+    fut = await channel.publish_confirmed(NOOP_SPAN, b'1', '', 'q')
+    with mock.patch('myaioapp.logic.amqp.publisher.STOP_TIMEOUT', .01):
+        await amqp.stop()
+    with pytest.raises(UserWarning):
+        fut.result()
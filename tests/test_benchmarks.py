@@ -0,0 +1,32 @@
+from benchmarks.fakes import Record
+from benchmarks.run import regressions, summary, trace_memory
+from myaioapp.logic.db import GetDate
+
+
+def test_fake_record():
+    record = Record(now=1, other=2)
+    assert GetDate._positions(record) == (0,)
+    assert record['other'] == record[1] == 2
+
+
+def test_regressions():
+    base = {'http': summary([.01] * 100, 1.)}
+    assert base['http']['throughput'] == 100
+    assert base['http']['p99_ms'] == 10
+    assert regressions({'http': summary([.0105] * 100, 1.05)},
+                       base, .1) == []
+    assert regressions({'http': summary([.02] * 100, 2.)},
+                       base, .1) == ['http throughput 50.00 < 100.00',
+                                     'http p99 20.000ms > 10.000ms']
+
+
+async def test_trace_memory(loop):
+    kept = []
+
+    async def call():
+        kept.append(bytearray(1000))
+
+    report = await trace_memory(10, 2, call)
+    assert report['memory_retained_blocks'] >= 10
+    assert report['memory_retained_kib'] >= 9.7
+    assert report['memory_peak_kib'] >= 9.7
@@ -3,8 +3,12 @@ import sys
 import os
 import pytest
 import mock
+from aioapp.config import ConfigError
 import myaioapp
-from myaioapp.cli import parse_argv, setup_logging, Args, main
+from myaioapp.cli import parse_argv, setup_logging, setup_loop, Args, main
+from myaioapp.config import Config
+from myaioapp.logic.db._pg_migrations import migrations
+from myaioapp.supervisor import worker_config
 
 
 def test_cli_success():
@@ -24,6 +28,37 @@ def test_cli_bad_log_level(capsys):
     assert 'SUCCESS' in err
 
 
+def test_cli_workers():
+    assert parse_argv('progname', []).workers is None
+    assert parse_argv('progname', ['--workers', '4']).workers == 4
+
+
+def test_cli_loop():
+    assert parse_argv('progname', []).loop is None
+    assert parse_argv('progname', ['--loop', 'uvloop']).loop == 'uvloop'
+    assert setup_loop('asyncio') == 'asyncio'
+    with mock.patch.dict('sys.modules', {'uvloop': None}):
+        assert setup_loop('uvloop') == 'asyncio'
+
+
+def test_cli_migrate():
+    assert not parse_argv('progname', []).migrate
+    assert parse_argv('progname', ['--migrate']).migrate
+    assert migrations()[0] == '0001_outbox.sql'
+
+
+def test_worker_config():
+    config = Config({'DB_URL': 'postgres://localhost/db',
+                     'DB_POOL_MIN_SIZE': '4', 'DB_POOL_MAX_SIZE': '10'})
+    wconfig = worker_config(config, 4)
+    assert wconfig.db_pool_max_size == 2
+    assert wconfig.db_pool_min_size == 2
+    assert config.db_pool_max_size == 10
+    assert worker_config(config, 10).db_pool_max_size == 1
+    with pytest.raises(ConfigError):
+        worker_config(config, 11)
+
+
 def test_cli_success_show_version():
     args = parse_argv('progname', ['-v'])
     assert args.version
@@ -0,0 +1,258 @@
+import asyncio
+from functools import partial
+import asyncpg
+import pytest
+import myaioapp.logic.db
+from benchmarks.fakes import FakeConnection, FakePostgres
+from myaioapp.metrics import REGISTRY
+from myaioapp.tracing import NOOP_SPAN
+from myaioapp.logic.db import PoolController, PoolLimit, Replica
+from myaioapp.logic.db import ResultCache
+from myaioapp.logic.db import StatementRegistry, GetDate, GetWeek
+from myaioapp.logic.db import InsertSomeTable, UpdateSomeTable
+from myaioapp.logic.db import InsertOutbox, ClaimOutbox, DeleteOutbox
+from myaioapp.logic.db._pg_migrations import migrations, pending_migrations
+from myaioapp.logic.db._pg_result import Result
+
+
+def test_result_slots():
+    row = GetDate(now=1)
+    assert GetDate.__fields__ == ('now',)
+    assert not hasattr(row, '__dict__')
+    assert row.asdict() == {'now': 1}
+
+
+def test_statement_registry_discover():
+    registry = StatementRegistry(myaioapp.logic.db)
+    assert set(registry.classes) == {GetDate, GetWeek, InsertSomeTable,
+                                     UpdateSomeTable, InsertOutbox,
+                                     ClaimOutbox, DeleteOutbox}
+
+
+async def test_statements_warm_statement_cache(loop):
+    db = FakePostgres(latency=0, pool_size=1,
+                      statements=StatementRegistry(myaioapp.logic.db))
+    db.loop = loop
+    await db.prepare()
+    prepares = len(db.statements.classes)
+    assert (db.queries, db.prepares) == (0, prepares)
+    await UpdateSomeTable.exec(NOOP_SPAN, db, 1)
+    await UpdateSomeTable.exec(NOOP_SPAN, db, 2)
+    assert (db.queries, db.prepares) == (2, prepares)
+
+
+async def test_prepared_statement_bypasses_cache(loop):
+    db = FakePostgres(latency=0, pool_size=1)
+    db.loop = loop
+    await db.prepare()
+    async with db.connection(NOOP_SPAN) as conn:
+        stmt = await conn._conn.prepare(UpdateSomeTable.__sql__)
+        await conn._conn.execute(UpdateSomeTable.__sql__, 1)
+    assert db.prepares == 2
+    with pytest.raises(asyncpg.InterfaceError):
+        await stmt.fetch(1)
+
+
+async def test_result_cache_single_flight(loop):
+    cache = ResultCache(ttl=60, max_entries=2)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(.01, loop=loop)
+        return len(calls)
+
+    res = await asyncio.gather(cache.get('a', fetch), cache.get('a', fetch),
+                               loop=loop)
+    assert res == [(1, False), (1, False)]
+    assert await cache.get('a', fetch) == (1, True)
+    assert len(calls) == 1
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+async def test_result_cache_lru_and_ttl(loop):
+    cache = ResultCache(ttl=60, max_entries=2)
+
+    async def fetch(val):
+        return val
+
+    await cache.get('a', partial(fetch, 1))
+    await cache.get('b', partial(fetch, 2))
+    await cache.get('a', partial(fetch, 1))
+    await cache.get('c', partial(fetch, 3))
+    assert await cache.get('b', partial(fetch, 4)) == (4, False)
+    assert await cache.get('c', partial(fetch, 5)) == (3, True)
+
+    cache.ttl = 0
+    await cache.get('d', partial(fetch, 6))
+    assert await cache.get('d', partial(fetch, 7)) == (7, False)
+
+
+async def test_exec_many_and_copy(loop):
+    db = FakePostgres(latency=0, pool_size=1)
+    db.loop = loop
+    await db.prepare()
+    assert await UpdateSomeTable.exec_many(NOOP_SPAN, db, [1, 2, 3]) == 3
+    assert await UpdateSomeTable.exec_many(NOOP_SPAN, db, []) == 0
+    assert db.queries == 1
+    rows = [(1, 10), (2, 20)]
+    assert await InsertSomeTable.exec_many(NOOP_SPAN, db, iter(rows)) == 2
+    assert db.queries == 2
+    assert db.pool_limit.in_use == 0
+
+    with pytest.raises(TypeError):
+        class Columns(Result):
+            __sql__ = 'SELECT 1'
+            __columns__ = ('id',)
+
+    class NoTable(Result):
+        __sql__ = 'SELECT 1'
+
+    with pytest.raises(TypeError):
+        await Result._copy_many(NoTable, NOOP_SPAN, db, rows)
+    assert db.queries == 2
+
+
+async def test_session(loop):
+    db = FakePostgres(latency=.01, pool_size=1)
+    db.loop = loop
+    await db.prepare()
+    GetDate.__cache__.clear()
+    GetWeek.__cache__.clear()
+    waits = REGISTRY.histogram('db_pool_wait_seconds')
+    count = waits.count
+    async with db.transaction(NOOP_SPAN) as session:
+        week = await GetWeek.exec(NOOP_SPAN, session)
+        date = await GetDate.exec(NOOP_SPAN, session)
+    assert len(week) == 7
+    assert date.now is not None
+    assert db.queries == 2
+    assert waits.count == count + 1
+
+    await GetDate.exec(NOOP_SPAN, db)
+    await GetDate.exec(NOOP_SPAN, db)
+    assert db.queries == 3
+    async with db.session(NOOP_SPAN) as session:
+        await GetDate.exec(NOOP_SPAN, session)
+    assert db.queries == 4
+
+
+class _ReplicaPool:
+
+    def __init__(self, db):
+        self._db = db
+
+    def acquire(self, timeout=None):
+        return self
+
+    async def __aenter__(self):
+        if self._db is None:
+            raise ConnectionResetError()
+        return FakeConnection(self._db)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+async def test_replica_routing(loop):
+    primary = FakePostgres(latency=0, pool_size=1)
+    standby = FakePostgres(latency=0, pool_size=1)
+    for db in (primary, standby):
+        db.loop = loop
+        await db.prepare()
+    busy = Replica('busy', 10., 60., name='busy')
+    idle = Replica('idle', 10., 60., pool_size=1, name='idle')
+    busy.pool, idle.pool = _ReplicaPool(standby), _ReplicaPool(standby)
+    busy.outstanding = 1
+    primary.replicas = [busy, idle]
+    assert primary.replica() is idle
+
+    GetWeek.__cache__.clear()
+    await GetWeek.exec(NOOP_SPAN, primary)
+    await InsertOutbox.exec(NOOP_SPAN, primary, 'ex', 'key', b'')
+    assert (primary.queries, standby.queries) == (1, 1)
+    assert idle.limit.in_use == 0
+    assert REGISTRY.gauge('db_pool_size', replica='idle').value == 1
+
+    idle.pool = _ReplicaPool(None)
+    GetWeek.__cache__.clear()
+    assert len(await GetWeek.exec(NOOP_SPAN, primary)) == 7
+    assert (primary.queries, standby.queries) == (2, 1)
+    assert not idle.available
+    assert primary.replica() is busy
+
+    busy.lag = 11.
+    GetWeek.__cache__.clear()
+    await GetWeek.exec(NOOP_SPAN, primary)
+    assert (primary.queries, standby.queries) == (3, 1)
+
+
+async def test_replica_stream_fallback(loop):
+    def conflict(params):
+        raise asyncpg.QueryCanceledError()
+
+    primary = FakePostgres(latency=0, pool_size=1)
+    standby = FakePostgres(latency=0, pool_size=1,
+                           rows={GetWeek.__sql__: conflict})
+    for db in (primary, standby):
+        db.loop = loop
+        await db.prepare()
+    replica = Replica('standby', 10., 60.)
+    replica.pool = _ReplicaPool(standby)
+    primary.replicas = [replica]
+
+    rows = [row async for row in GetWeek.exec_iter(NOOP_SPAN, primary)]
+    assert len(rows) == 7
+    assert (primary.queries, standby.queries) == (1, 1)
+    assert not replica.available
+    assert replica.outstanding == 0
+
+
+async def test_pool_limit(loop):
+    limit = PoolLimit(1)
+    await limit.acquire(loop)
+    waiter = asyncio.ensure_future(limit.acquire(loop), loop=loop)
+    cancelled = asyncio.ensure_future(limit.acquire(loop), loop=loop)
+    await asyncio.sleep(0, loop=loop)
+    assert (limit.in_use, limit.waiting) == (1, 2)
+    cancelled.cancel()
+    limit.resize(2)
+    await waiter
+    await asyncio.sleep(0, loop=loop)
+    assert (limit.in_use, limit.waiting) == (2, 0)
+    limit.observe(.5)
+    assert limit.window() == (.5, 2, 2)
+
+
+def test_pool_controller():
+    limit = PoolLimit(4)
+    controller = PoolController(limit, min_size=2, max_size=6,
+                                target_wait=.01, max_saturation=.9)
+    assert controller.adjust(.05, 4, 3, saturation=.95) == 4
+    assert controller.adjust(.05, 4, 3, saturation=None) == 4
+    assert controller.adjust(.05, 4, 3, saturation=.5) == 5
+    assert controller.adjust(.05, 5, 3, saturation=.5) == 6
+    assert controller.adjust(.05, 6, 3, saturation=.5) == 6
+    assert controller.adjust(.001, 1, 0, saturation=None) == 5
+    assert controller.adjust(0., 0, 0, saturation=None) == 4
+    assert controller.adjust(0., 3, 0, saturation=None) == 4
+    assert limit.size == 4
+
+
+async def test_pending_migrations(loop):
+    class Conn:
+        table = None
+        applied = []
+
+        async def fetchval(self, query):
+            return self.table
+
+        async def fetch(self, query):
+            return [{'name': name} for name in self.applied]
+
+    conn = Conn()
+    assert await pending_migrations(conn) == migrations()
+    conn.table = 'schema_migrations'
+    assert await pending_migrations(conn) == migrations()
+    conn.applied = migrations()
+    assert await pending_migrations(conn) == []
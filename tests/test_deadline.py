@@ -0,0 +1,75 @@
+import asyncio
+import pytest
+from benchmarks.fakes import FakePostgres
+from myaioapp.logic.db import GetDate, UpdateSomeTable
+from myaioapp.logic.deadline import (DeadlineExceeded, budget, deadline,
+                                     remaining)
+from myaioapp.logic.fanout import fanout
+from myaioapp.tracing import NOOP_SPAN
+
+
+async def test_deadline_budget(loop):
+    assert remaining() is None
+    assert budget(1.) == 1.
+    with deadline(10):
+        with deadline(.5):
+            assert budget(1.) <= .5
+            assert budget(None) <= .5
+        assert budget(1.) == 1.
+
+        async def child():
+            return remaining()
+
+        left, = await fanout(child(), loop=loop)
+        assert 9 < left <= 10
+    assert remaining() is None
+    with deadline(.01):
+        await asyncio.sleep(.02, loop=loop)
+        with pytest.raises(DeadlineExceeded):
+            budget(1.)
+
+
+async def test_result_deadline(loop):
+    db = FakePostgres(latency=.1, pool_size=1)
+    db.loop = loop
+    await db.prepare()
+    with deadline(.05):
+        with pytest.raises(asyncio.TimeoutError):
+            await fanout(UpdateSomeTable.exec(NOOP_SPAN, db, 1),
+                         UpdateSomeTable.exec(NOOP_SPAN, db, 2), loop=loop)
+    assert db.pool_limit.in_use == 0
+    with deadline(.01):
+        await asyncio.sleep(.02, loop=loop)
+        with pytest.raises(DeadlineExceeded):
+            await UpdateSomeTable.exec(NOOP_SPAN, db, 1)
+    assert db.queries == 0
+
+
+async def test_cache_hit_past_deadline(loop):
+    db = FakePostgres(latency=.01, pool_size=1)
+    db.loop = loop
+    await db.prepare()
+    GetDate.__cache__.clear()
+    res = await GetDate.exec(NOOP_SPAN, db)
+    with deadline(.01):
+        await asyncio.sleep(.02, loop=loop)
+        assert await GetDate.exec(NOOP_SPAN, db) == res
+    assert db.queries == 1
+    GetDate.__cache__.clear()
+
+
+async def test_session_deadline(loop):
+    db = FakePostgres(latency=.01, pool_size=1)
+    db.loop = loop
+    await db.prepare()
+    async with db.connection(NOOP_SPAN):
+        with deadline(.05):
+            with pytest.raises(asyncio.TimeoutError):
+                async with db.transaction(NOOP_SPAN):
+                    pass
+        assert db.pool_limit.waiting == 0
+        assert db.pool_limit.in_use == 1
+    assert db.pool_limit.in_use == 0
+    async with db.transaction(NOOP_SPAN) as session:
+        await UpdateSomeTable.exec(NOOP_SPAN, session, 1)
+    assert db.pool_limit.in_use == 0
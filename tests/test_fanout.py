@@ -0,0 +1,23 @@
+import asyncio
+import pytest
+from myaioapp.logic.fanout import fanout
+
+
+async def test_fanout_results_order(loop):
+    async def value(val, delay):
+        await asyncio.sleep(delay, loop=loop)
+        return val
+
+    res = await fanout(value(1, .02), value(2, .01), value(3, 0), loop=loop)
+    assert res == [1, 2, 3]
+
+
+async def test_fanout_cancels_siblings(loop):
+    async def fail():
+        await asyncio.sleep(.01, loop=loop)
+        raise UserWarning()
+
+    slow = asyncio.ensure_future(asyncio.sleep(10, loop=loop), loop=loop)
+    with pytest.raises(UserWarning):
+        await fanout(slow, fail(), loop=loop)
+    assert slow.cancelled()
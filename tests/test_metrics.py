@@ -0,0 +1,53 @@
+import socket
+from myaioapp.metrics import (MAX_DATAGRAM_SIZE, MetricsFlusher, Registry,
+                              _datagrams)
+
+
+def test_registry_render():
+    registry = Registry()
+    registry.counter('requests_total', route='/').inc(2)
+    hist = registry.histogram('duration_seconds', buckets=(.1, 1.),
+                              route='/')
+    hist.observe(.05)
+    hist.observe(.5)
+    hist.observe(5.)
+    assert registry.render() == (
+        '# TYPE duration_seconds histogram\n'
+        'duration_seconds_bucket{route="/",le="0.1"} 1\n'
+        'duration_seconds_bucket{route="/",le="1"} 2\n'
+        'duration_seconds_bucket{route="/",le="+Inf"} 3\n'
+        'duration_seconds_sum{route="/"} 5.55\n'
+        'duration_seconds_count{route="/"} 3\n'
+        '# TYPE requests_total counter\n'
+        'requests_total{route="/"} 2\n'
+    )
+
+
+def test_registry_influx_lines():
+    registry = Registry()
+    registry.counter('requests_total', route='a b').inc()
+    registry.gauge('pool_size').set(3)
+    assert registry.influx_lines('app_', ts=1) == [
+        'app_requests_total,route=a\\ b value=1i 1',
+        'app_pool_size value=3.0 1',
+    ]
+    datagrams = list(_datagrams(['x' * 5000, 'y' * 5000]))
+    assert len(datagrams) == 2
+
+
+async def test_metrics_flusher(loop):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(1)
+    registry = Registry()
+    registry.counter('requests_total').inc()
+    flusher = MetricsFlusher('udp://127.0.0.1:%d' % sock.getsockname()[1],
+                             'app_', 10, registry)
+    flusher.loop = loop
+    try:
+        await flusher.prepare()
+        flusher.flush()
+        assert sock.recv(MAX_DATAGRAM_SIZE).startswith(b'app_requests_total')
+    finally:
+        await flusher.stop()
+        sock.close()
@@ -0,0 +1,27 @@
+import time
+import asyncio
+from myaioapp.metrics import REGISTRY
+from myaioapp.monitor import LoopMonitor
+
+
+def _block():
+    time.sleep(.2)
+
+
+async def test_loop_monitor_reports_blocking(loop, caplog):
+    monitor = LoopMonitor(interval=.01, threshold=.05)
+    monitor.loop = loop
+    blocked = REGISTRY.histogram('loop_blocked_seconds')
+    count = blocked.count
+    await monitor.start()
+    watchdog = monitor._watchdog
+    try:
+        await asyncio.sleep(.03, loop=loop)
+        _block()
+        await asyncio.sleep(.03, loop=loop)
+    finally:
+        await monitor.stop()
+    assert not watchdog.is_alive()
+    assert blocked.count == count + 1
+    assert REGISTRY.histogram('loop_lag_seconds').count > 0
+    assert 'in _block' in caplog.text
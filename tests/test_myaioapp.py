@@ -1,6 +1,7 @@
 from aiohttp import ClientSession, web
 from asyncpg.exceptions import UndefinedTableError
 from myaioapp.app import Application
+from myaioapp.metrics import REGISTRY
 from .misc import check_app_errors, check_app_raises, wait_for
 
 
@@ -17,6 +18,28 @@ async def test_myaioapp(server: Application, client: ClientSession):
 
     await wait_for(server, check)
     assert server.rmq_consumer.message_counter == 1
+    assert REGISTRY.counter('outbox_relayed_total').value == 1
+
+
+@check_app_errors
+async def test_stream_week(server: Application, client: ClientSession):
+    url = 'http://127.0.0.1:%d/week' % server.http_server.port
+    resp = await client.get(url)
+    assert resp.status == 200
+    lines = (await resp.text()).splitlines()
+    assert len(lines) == 7
+
+
+@check_app_errors
+async def test_health(server: Application, client: ClientSession):
+    url = 'http://127.0.0.1:%d/health/' % server.http_server.port
+    resp = await client.get(url + 'live')
+    assert resp.status == 200
+    resp = await client.get(url + 'ready')
+    assert resp.status == 200
+    assert await resp.json() == {'ready': True,
+                                 'checks': {'rabbit': True,
+                                            'postgres': True}}
 
 
 @check_app_errors
@@ -36,3 +59,9 @@ async def test_error_internal_error(server: Application,
         resp = await client.get(url)
     assert resp.status == 500
     assert 'Internal Server Error' in await resp.text()
+
+
+async def test_startup_timings(server: Application):
+    for stage in ('http_server.start', 'rabbit.prepare', 'rabbit.start',
+                  'postgres.prepare', 'total'):
+        assert stage in server.startup_timings
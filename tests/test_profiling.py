@@ -0,0 +1,47 @@
+from myaioapp.profiling import Profiler
+
+
+class _Request:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+def test_profiler_capture_and_rotate(tmpdir):
+    profiler = Profiler(str(tmpdir), max_files=2, token='secret')
+    assert profiler.begin('/', _Request({})) is None
+    assert profiler.begin('/', _Request({'X-Profile': 'wrong'})) is None
+    assert profiler.authorized(_Request({'X-Profile': 'secret'}), admin=True)
+
+    for _ in range(3):
+        capture = profiler.begin('/week', _Request({'X-Profile': 'secret'}))
+        assert capture is not None
+        assert profiler.begin('/', _Request({'X-Profile': 'secret'})) is None
+        sum(range(1000))
+        snapshot = capture.stop()
+        profiler._active = None
+        profiler._save(capture, snapshot, .1)
+
+    names = [item['name'] for item in profiler.profiles()]
+    assert len(names) == 4
+    assert all('_week' in name for name in names)
+    assert profiler.path(names[0]) == str(tmpdir.join(names[0]))
+    assert profiler.path('../etc/passwd') is None
+    report = tmpdir.join([n for n in names if n.endswith('.txt')][0]).read()
+    assert 'route: /week' in report
+    assert 'allocations:' in report
+
+
+def test_profiler_arms_slow_route(tmpdir):
+    profiler = Profiler(str(tmpdir), slow_threshold=1.)
+    profiler._armed.add('/')
+    capture = profiler.begin('/', _Request({}))
+    assert capture is not None
+    capture.stop()
+    assert profiler._armed == set()
+
+
+def test_profiler_admin_needs_token(tmpdir):
+    profiler = Profiler(str(tmpdir))
+    assert profiler.authorized(_Request({'X-Profile': ''}))
+    assert not profiler.authorized(_Request({'X-Profile': ''}), admin=True)
+    assert not profiler.authorized(_Request({}), admin=True)
@@ -0,0 +1,115 @@
+from myaioapp.metrics import REGISTRY
+from myaioapp.tracing import (NOOP_SPAN, ConstSampler, RateLimitingSampler,
+                              RecordingSpan, SpanExporter, TraceSampler,
+                              create_sampler, is_recording)
+
+
+class _Span:
+    def __init__(self, name=None, kind=None):
+        self.name = name
+        self.tags = {}
+        self.children = []
+        self.started = self.finished = None
+
+    def new_child(self, name=None, kind=None):
+        child = _Span(name, kind)
+        self.children.append(child)
+        return child
+
+    def start(self, ts=None):
+        self.started = ts
+
+    def finish(self, ts=None, exception=None):
+        self.finished = ts
+
+    def tag(self, key, value):
+        self.tags[key] = value
+
+    metrics_tag = tag
+
+
+def test_rate_limiting_sampler():
+    sampler = RateLimitingSampler(2)
+    assert [sampler.sample() for _ in range(3)] == [True, True, False]
+    assert isinstance(create_sampler('ratelimiting', 1), RateLimitingSampler)
+
+
+def test_unsampled_span_is_noop():
+    tracing = TraceSampler(ConstSampler(False))
+    ctx = _Span()
+    span = tracing.begin(ctx)
+    assert span is NOOP_SPAN
+    assert span.new_child('db:GetDate') is NOOP_SPAN
+    assert not is_recording(span)
+    tracing.end(ctx, span, 10., True)
+    assert ctx.children == []
+
+
+def test_slow_trace_is_kept():
+    tracing = TraceSampler(ConstSampler(False), slow_threshold=1.)
+    ctx = _Span()
+    fast = tracing.begin(ctx)
+    with fast.new_child('db:GetDate'):
+        pass
+    tracing.end(ctx, fast, .5)
+    assert ctx.children == []
+
+    slow = tracing.begin(ctx)
+    assert isinstance(slow, RecordingSpan)
+    with slow.new_child('db:GetWeek') as span:
+        span.tag('db.rows', '7')
+        with span.new_child('db:connect'):
+            pass
+    tracing.end(ctx, slow, 1.5)
+    assert ctx.tags == {'sampling.kept': 'slow'}
+    assert [child.name for child in ctx.children] == ['db:GetWeek']
+    child = ctx.children[0]
+    assert child.tags == {'db.rows': '7'}
+    assert child.started is not None and child.finished >= child.started
+    assert [c.name for c in child.children] == ['db:connect']
+
+
+def test_span_exporter_drops_when_full():
+    exporter = SpanExporter('http://127.0.0.1:9411/', max_queue_size=2)
+    assert exporter.url == 'http://127.0.0.1:9411/api/v2/spans'
+    dropped = REGISTRY.counter('tracer_spans_dropped_total')
+    before = dropped.value
+    for record in range(3):
+        exporter.send(record)
+    assert list(exporter._queue) == [0, 1]
+    assert dropped.value == before + 1
+
+
+class _Tracer:
+    def __init__(self):
+        self.roots = []
+
+    def new_trace(self, sampled=None, debug=False):
+        root = _Span()
+        root.sampled = sampled
+        self.roots.append(root)
+        return root
+
+
+def test_head_sampling_before_root_span():
+    tracer = _Tracer()
+    tracing = TraceSampler(ConstSampler(False))
+    tracing.install(tracer)
+    ctx = tracer.new_trace()
+    assert ctx.sampled is False
+    assert tracing.begin(ctx) is NOOP_SPAN
+    assert tracing.begin(NOOP_SPAN) is NOOP_SPAN
+    assert tracer.new_trace(sampled=True).sampled is True
+
+    tracing = TraceSampler(ConstSampler(False), slow_threshold=1.)
+    tracing.install(tracer)
+    ctx = tracer.new_trace()
+    assert ctx.sampled is True
+    assert isinstance(tracing.begin(ctx), RecordingSpan)
+
+
+def test_spans_ignore_unknown_methods():
+    assert NOOP_SPAN.set_tag('key', 'value') is NOOP_SPAN
+    span = RecordingSpan()
+    assert span.set_tag('key', 'value') is span
+    assert not hasattr(span, '__missing__')